@@ -0,0 +1,170 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+from utils import getValueFromConfig
+
+
+class OverloadedError(Exception):
+    """Raised when a turn can't be admitted in time; retry_after is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _ThreadLock:
+    """Lock of one thread, with the number of turns holding or waiting for it"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class _AdmissionController:
+    """Internal admission controller (not exposed directly)
+
+    Turns on the same thread run one at a time, in arrival order, so they don't
+    race on the thread's checkpoint. Across threads at most `max_in_flight` turns
+    run the graph at once; the rest wait up to `queue_timeout_seconds`, and when
+    `max_queued` turns are already waiting new ones are rejected right away.
+    """
+
+    def __init__(self):
+        # checkpoint thread id -> _ThreadLock, for threads with turns running or waiting
+        self._thread_locks = {}
+        self._slots = None
+        self._max_in_flight = 8
+        self._max_queued = 32
+        self._queue_timeout = 30.0
+        self._in_flight = 0
+        self._queued = 0
+        # Moving average of turn duration, for the Retry-After hint
+        self._average_turn_seconds = 5.0
+        self._initialized = False
+        self._lock = asyncio.Lock()
+
+    async def initialize(self):
+        """Initialize the admission controller"""
+        async with self._lock:
+            if not self._initialized:
+                self._max_in_flight = getValueFromConfig("admission", "max_in_flight", self._max_in_flight)
+                self._max_queued = getValueFromConfig("admission", "max_queued", self._max_queued)
+                self._queue_timeout = getValueFromConfig("admission", "queue_timeout_seconds", self._queue_timeout)
+                self._slots = asyncio.Semaphore(self._max_in_flight)
+                self._initialized = True
+                print("Admission controller initialized successfully!")
+
+    async def cleanup(self):
+        """Cleanup the admission controller"""
+        async with self._lock:
+            if self._initialized:
+                self._initialized = False
+                self._slots = None
+                print("Admission controller cleaned up successfully!")
+
+    def _retry_after(self) -> int:
+        # Time for the turns ahead to drain through the available slots
+        backlog = (self._queued + self._in_flight) / max(1, self._max_in_flight)
+        return max(1, math.ceil(backlog * self._average_turn_seconds))
+
+    def _overloaded(self, reason: str) -> OverloadedError:
+        return OverloadedError(f"Server is busy ({reason}), retry later", self._retry_after())
+
+    async def _wait(self, awaitable, deadline: float, reason: str):
+        try:
+            await asyncio.wait_for(awaitable, max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise self._overloaded(reason)
+
+    async def acquire(self, thread_id: str) -> "_AdmittedTurn":
+        """Take the thread's lock and a graph slot; release them with the returned turn's release()"""
+        if not self._initialized:
+            return _AdmittedTurn(None, None, None)
+        if self._queued >= self._max_queued:
+            raise self._overloaded(f"{self._queued} turns queued")
+
+        deadline = time.monotonic() + self._queue_timeout
+        thread_lock = self._thread_locks.setdefault(thread_id, _ThreadLock())
+        thread_lock.users += 1
+        self._queued += 1
+        has_lock = False
+        try:
+            await self._wait(thread_lock.lock.acquire(), deadline, "another turn of this thread is running")
+            has_lock = True
+            await self._wait(self._slots.acquire(), deadline, f"{self._in_flight} turns running")
+        except BaseException:
+            if has_lock:
+                thread_lock.lock.release()
+            self._release_thread_lock(thread_id, thread_lock)
+            raise
+        finally:
+            self._queued -= 1
+        self._in_flight += 1
+        return _AdmittedTurn(self, thread_id, thread_lock)
+
+    def _release(self, thread_id: str, thread_lock: _ThreadLock, slots: asyncio.Semaphore, started: float):
+        self._in_flight -= 1
+        slots.release()
+        thread_lock.lock.release()
+        self._release_thread_lock(thread_id, thread_lock)
+        self._average_turn_seconds += 0.2 * (time.monotonic() - started - self._average_turn_seconds)
+
+    def _release_thread_lock(self, thread_id: str, thread_lock: _ThreadLock):
+        thread_lock.users -= 1
+        if thread_lock.users == 0:
+            del self._thread_locks[thread_id]
+
+    @asynccontextmanager
+    async def admit(self, thread_id: str):
+        """Hold the thread's lock and a graph slot for the duration of a turn"""
+        turn = await self.acquire(thread_id)
+        try:
+            yield
+        finally:
+            turn.release()
+
+
+class _AdmittedTurn:
+    """A turn holding its thread's lock and a graph slot, until release() is called"""
+
+    def __init__(self, controller: _AdmissionController | None, thread_id: str | None, thread_lock: _ThreadLock | None):
+        self._controller = controller
+        self._thread_id = thread_id
+        self._thread_lock = thread_lock
+        self._slots = controller._slots if controller else None
+        self._started = time.monotonic()
+        self._released = controller is None
+
+    def release(self):
+        """Release the lock and slot; safe to call more than once"""
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self._thread_id, self._thread_lock, self._slots, self._started)
+
+
+# Module-level singleton instance
+_manager = _AdmissionController()
+
+# Public API
+async def initialize_admission_controller():
+    await _manager.initialize()
+
+async def cleanup_admission_controller():
+    await _manager.cleanup()
+
+def admit_turn(thread_id: str):
+    """Context manager that serializes turns per checkpoint thread id and caps turns in flight.
+
+    Raises OverloadedError when the turn can't start within the queue timeout.
+    """
+    return _manager.admit(thread_id)
+
+async def acquire_turn(thread_id: str) -> _AdmittedTurn:
+    """Like admit_turn, for turns that outlive the caller's scope, e.g. a streamed response.
+
+    The turn must be released with its release() method.
+    """
+    return await _manager.acquire(thread_id)
@@ -1,25 +1,39 @@
 # For state management
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
 from langchain.messages import AnyMessage, HumanMessage
-from langchain_core.messages import trim_messages
 from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool, StructuredTool
 from typing_extensions import TypedDict, Annotated
-import operator
 
 from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
 
 from typing import Literal
 
 from langchain.messages import SystemMessage, ToolMessage
 
-from tools_manager import get_tool_registry, get_tools_by_query
-from memory_store import getMemoriesForUserBasedOnQuery, updateMemoryForUser
-from utils import convert_arg_types
+from tools_manager import cache_tool_result, get_cached_tool_result, get_tool_registry, get_tool_registry_version, get_tools_by_query
+from memory_store import getMemoriesForUserBasedOnQuery
+from memory_worker import enqueue_memory_update
+from token_counter import getTokenCounter, merge_token_counts, trim_to_budget
+from utils import convert_arg_types, getValueFromConfig
 
 class MessagesState(TypedDict):
-    messages: Annotated[list[AnyMessage], operator.add]
+    # add_messages gives every message an id, which keys its token count
+    messages: Annotated[list[AnyMessage], add_messages]
+    # Tokens of each message by message id, counted once when first trimmed
+    token_counts: Annotated[dict[str, int], merge_token_counts]
     llm_calls: int
     selected_tools: list[str]
     query: str
+    # Memories retrieved for the current turn's query by memory_retrieval_node
+    memories: list[str]
+    # Summary of the older turns that were compacted out of messages
+    summary: str
 
 def should_continue(state: MessagesState) -> Literal["tool_node", "update_memory_node"]:
     """Decide if we should continue the loop or stop based upon whether the LLM made a tool call"""
@@ -34,43 +48,60 @@ def should_continue(state: MessagesState) -> Literal["tool_node", "update_memory
     # Otherwise, we stop (reply to the user)
     return "update_memory_node"
 
-def getLLMCallWithModel(model):
+def getLLMCallWithModel(model, token_counting_model=None, max_bound_tool_sets: int = 64):
+    max_context_tokens = getValueFromConfig("agent", "max_context_tokens", 64000)
+    count_tokens = getTokenCounter(getValueFromConfig("agent", "token_counter", "estimate"), token_counting_model or model)
+
+    # (tool registry version, frozenset of tool IDs) -> model bound to those tools, least recently used first
+    bound_models = OrderedDict()
+
+    def bind_selected_tools(tool_ids: list[str]):
+        """Bind the tools to the model once per tool set instead of on every call"""
+        key = (get_tool_registry_version(), frozenset(tool_ids))
+        model_with_tools = bound_models.get(key)
+        if model_with_tools is None:
+            tool_registry = get_tool_registry()
+            selected_tools = [tool_registry[id] for id in tool_ids]
+            print(f"Selected tools:\n\n {selected_tools} \n\n")
+            model_with_tools = model.bind_tools(selected_tools)
+            bound_models[key] = model_with_tools
+            while len(bound_models) > max_bound_tool_sets:
+                bound_models.popitem(last=False)
+        bound_models.move_to_end(key)
+        return model_with_tools
+
     async def llm_call(state: dict, config: RunnableConfig):
         """LLM decides whether to call a tool or not"""
 
-        user_id = config["configurable"]["user_id"]
-
-        memories = getMemoriesForUserBasedOnQuery(user_id, state["query"])
+        # Retrieved once per turn, in parallel with tool search
+        memories = state.get("memories") or []
         memories_info = "\n".join(memories)
         print(f"Memories:\n\n {memories_info} \n\n")
+        summary = state.get("summary")
+        summary_info = f"\nSummary of the earlier conversation with the user: {summary}\n" if summary else ""
         # Map tool IDs to actual tools
         # based on the state's selected_tools list.
-        tool_registry = get_tool_registry()
-        selected_tools = [tool_registry[id] for id in state["selected_tools"]]
-
-        print(f"Selected tools:\n\n {selected_tools} \n\n")
-        model_with_tools = model.bind_tools(selected_tools)
+        model_with_tools = bind_selected_tools(state["selected_tools"])
 
         # Trim messages to stay under token limit
-        # Keep the most recent messages that fit within max_tokens
-        trimmed_messages = trim_messages(
+        # Keep the most recent messages that fit within max_tokens,
+        # counting only messages added since the last call
+        trimmed_messages, new_token_counts = trim_to_budget(
             state["messages"],
-            max_tokens=64000,  # Adjust based on your model's context window
-            strategy="last",  # Keep the most recent messages
-            token_counter=model_with_tools,  # Use the model to count tokens
-            include_system=False,  # System message handled separately
-            allow_partial=False,  # Don't cut messages in half
+            state.get("token_counts") or {},
+            max_context_tokens,
+            count_tokens,
         )
 
         return {
             "messages": [
-                model_with_tools.invoke(
+                await model_with_tools.ainvoke(
                     [
                         SystemMessage(
                             content=f"""
 You are a helpful assistant tasked with performing operations. You can use the tools provided to you if needed to perform the operations."
 Here are some relevant memories from the past interactions with the user: {memories_info}.
-IMPORTANT: When you receive a tool result (ToolMessage), you MUST use that information in your response. Tool results contain fresh, up-to-date information that should take priority in your answer.
+{summary_info}IMPORTANT: When you receive a tool result (ToolMessage), you MUST use that information in your response. Tool results contain fresh, up-to-date information that should take priority in your answer.
 Provider clear and helpful answer in english language. Do not output JSON.
 """
                         )
@@ -78,35 +109,90 @@ Provider clear and helpful answer in english language. Do not output JSON.
                     + trimmed_messages
                 )
             ],
-            "llm_calls": state.get('llm_calls', 0) + 1
+            "llm_calls": state.get('llm_calls', 0) + 1,
+            "token_counts": new_token_counts
         }
     return llm_call
 
+def _has_async_implementation(tool) -> bool:
+    """Whether the tool implements ainvoke natively rather than wrapping a sync function"""
+    if isinstance(tool, StructuredTool):
+        return tool.coroutine is not None
+    return type(tool)._arun is not BaseTool._arun
+
 def getToolNode(tools):
     tools_by_name = {tool.name: tool for tool in tools}
-    
-    async def tool_node(state: dict):
-        """Performs the tool call"""
-
-        result = []
-        for tool_call in state["messages"][-1].tool_calls:
-            tool = tools_by_name[tool_call["name"]]
-            # Convert argument types
-            args = {key: convert_arg_types(value) for key, value in tool_call["args"].items()}
-            
-            observation = await tool.ainvoke(args)
-            result.append(ToolMessage(content=observation, tool_call_id=tool_call["id"]))
-        return {"messages": result}
+    max_concurrent_calls = getValueFromConfig("tools", "max_concurrent_calls", 4)
+    default_timeout = getValueFromConfig("tools", "call_timeout_seconds", 60)
+    # Per-tool overrides of the call timeout, by tool name
+    timeouts = getValueFromConfig("tools", "call_timeouts", {})
+    # Sync tools get their own pool, so a hung tool can only starve other tool calls, never
+    # memory retrieval or shard flushes on the shared blocking pool. By default it fits
+    # max_concurrent_calls for every turn in flight.
+    pool_size = getValueFromConfig(
+        "tools", "call_pool_size",
+        max_concurrent_calls * getValueFromConfig("admission", "max_in_flight", 8),
+    )
+    tool_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="tool")
+
+    async def run_tool_call(tool_call, user_id: str, semaphore: asyncio.Semaphore) -> ToolMessage:
+        tool = tools_by_name.get(tool_call["name"])
+        if tool is None:
+            return ToolMessage(content=f"Error: unknown tool '{tool_call['name']}'", tool_call_id=tool_call["id"], status="error")
+
+        # Convert argument types
+        args = {key: convert_arg_types(value) for key, value in tool_call["args"].items()}
+        hit, observation = get_cached_tool_result(tool, args, user_id)
+        if hit:
+            return ToolMessage(content=observation, tool_call_id=tool_call["id"])
+
+        timeout = timeouts.get(tool.name, default_timeout)
+        async with semaphore:
+            try:
+                if _has_async_implementation(tool):
+                    observation = await asyncio.wait_for(tool.ainvoke(args), timeout=timeout)
+                else:
+                    # On timeout the tool's thread finishes in the background
+                    call = asyncio.get_running_loop().run_in_executor(tool_executor, functools.partial(tool.invoke, args))
+                    observation = await asyncio.wait_for(call, timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"Tool {tool.name} timed out after {timeout}s")
+                return ToolMessage(content=f"Error: tool '{tool.name}' timed out after {timeout} seconds", tool_call_id=tool_call["id"], status="error")
+            except Exception as e:
+                print(f"Tool {tool.name} failed: {e}")
+                return ToolMessage(content=f"Error: tool '{tool.name}' failed: {e}", tool_call_id=tool_call["id"], status="error")
+        cache_tool_result(tool, args, user_id, observation)
+        return ToolMessage(content=observation, tool_call_id=tool_call["id"])
+
+    async def tool_node(state: dict, config: RunnableConfig):
+        """Performs the tool calls of the last message concurrently"""
+
+        user_id = config["configurable"]["user_id"]
+        semaphore = asyncio.Semaphore(max_concurrent_calls)
+        # gather keeps the results in the order of the tool calls
+        result = await asyncio.gather(
+            *(run_tool_call(tool_call, user_id, semaphore) for tool_call in state["messages"][-1].tool_calls)
+        )
+        return {"messages": list(result)}
     return tool_node
 
 def getSemanticToolSearchNode():
     async def semantic_tool_search_node(state: dict):
         """Searches the vector store for tools related to the query"""
         query = state["messages"][-1].content
-        results = get_tools_by_query(query)
+        results = await get_tools_by_query(query)
         return {"selected_tools": results, "query": query}
     return semantic_tool_search_node
 
+def getMemoryRetrievalNode():
+    async def memory_retrieval_node(state: dict, config: RunnableConfig):
+        """Retrieves the user's memories related to the query"""
+        user_id = config["configurable"]["user_id"]
+        query = state["messages"][-1].content
+        memories = await getMemoriesForUserBasedOnQuery(user_id, query)
+        return {"memories": memories}
+    return memory_retrieval_node
+
 def getUpdateMemoryNode(model):
 
     async def memory_creator(prompt) -> str:
@@ -114,7 +200,7 @@ def getUpdateMemoryNode(model):
         return memory_obj.content
     
     async def update_memory_node(state: dict, config: RunnableConfig):
-        """Updates the memory store with the new memory"""
+        """Queues the finished turn for memory creation in the background"""
         
         # Extract last messages from the state after the last human message
         filtered_messages = []
@@ -128,29 +214,36 @@ def getUpdateMemoryNode(model):
         filtered_messages = filtered_messages[::-1]
 
         user_id = config["configurable"]["user_id"]
-        await updateMemoryForUser(user_id, filtered_messages, memory_creator)
+        thread_id = config["configurable"]["thread_id"]
+        await enqueue_memory_update(thread_id, user_id, filtered_messages, memory_creator)
         return {}
     return update_memory_node
 
-def getAgent(model, tools, checkpointer, memory_store):
+def getAgent(model, tools, checkpointer, memory_store, memory_model=None, token_counting_model=None):
+    # Background summarization and token counting use the chat model unless routed elsewhere
+    memory_model = memory_model or model
 
     # Build workflow
     agent_builder = StateGraph(MessagesState)
 
     # Add nodes
-    agent_builder.add_node("llm_call", getLLMCallWithModel(model))
+    agent_builder.add_node("llm_call", getLLMCallWithModel(model, token_counting_model))
     agent_builder.add_node("tool_node", getToolNode(tools))
     agent_builder.add_node("semantic_tool_search_node", getSemanticToolSearchNode())
-    agent_builder.add_node("update_memory_node", getUpdateMemoryNode(model))
+    agent_builder.add_node("memory_retrieval_node", getMemoryRetrievalNode())
+    agent_builder.add_node("update_memory_node", getUpdateMemoryNode(memory_model))
     # Add edges to connect nodes
+    # Tool search and memory retrieval are independent, so they run in parallel
     agent_builder.add_edge(START, "semantic_tool_search_node")
-    agent_builder.add_edge("semantic_tool_search_node", "llm_call")
+    agent_builder.add_edge(START, "memory_retrieval_node")
+    agent_builder.add_edge(["semantic_tool_search_node", "memory_retrieval_node"], "llm_call")
     agent_builder.add_conditional_edges(
         "llm_call",
         should_continue,
         {"tool_node": "tool_node", "update_memory_node": "update_memory_node"}
     )
     agent_builder.add_edge("tool_node", "llm_call")
+    # Compaction of long threads runs after the response, see history_compactor
     agent_builder.add_edge("update_memory_node", END)
 
     # Compile the agent
@@ -1,10 +1,23 @@
 import asyncio
-from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
 
+from checkpoint_retention import CheckpointRetention, RetentionPolicy
+from checkpoint_serde import CompressedSerializer
+from checkpoint_storage import StorageSettings, open_checkpoint_storage
+from conversation_index import forget_conversations
+from history_cache import invalidate_history
 from memory_store import get_memory_store
 from model import getModel
-from tools import getTools
+from tools_manager import get_tools as get_registered_tools
 from agent import getAgent
+from utils import getValueFromConfig
+
+
+async def _forget_deleted_threads(full_thread_ids: list[str]):
+    """Drop threads deleted by checkpoint retention from the index and the history cache"""
+    for full_thread_id in full_thread_ids:
+        invalidate_history(full_thread_id)
+    await forget_conversations(full_thread_ids)
 
 
 class _AgentManager:
@@ -16,8 +29,11 @@ class _AgentManager:
         self._tools = None
         self._initialized = False
         self._checkpointer = None 
+        # Separate checkpointer for reads that don't go through the graph, like history
+        self._reader_checkpointer = None
         self._checkpointer_context = None
         self._memory_store = None
+        self._retention = None
         self._lock = asyncio.Lock()
     
     async def initialize(self):
@@ -26,14 +42,54 @@ class _AgentManager:
             if not self._initialized:
                 print("Initializing Agent...")
 
-                # Use SQLite instead of PostgreSQL - much simpler!
-                self._checkpointer_context = AsyncSqliteSaver.from_conn_string("checkpoints.db")
-                self._checkpointer = await self._checkpointer_context.__aenter__()
+                storage = StorageSettings(
+                    backend=getValueFromConfig("checkpoints", "backend", "sqlite"),
+                    path=getValueFromConfig("checkpoints", "path", "checkpoints.db"),
+                    postgres_url=getValueFromConfig("checkpoints", "postgres_url"),
+                    synchronous=getValueFromConfig("checkpoints", "sqlite_synchronous", "NORMAL"),
+                    cache_size_mb=getValueFromConfig("checkpoints", "sqlite_cache_size_mb", 64),
+                    mmap_size_mb=getValueFromConfig("checkpoints", "sqlite_mmap_size_mb", 256),
+                )
+                serde = None
+                if getValueFromConfig("checkpoints", "compression", "zstd") == "zstd":
+                    # Existing uncompressed checkpoints stay readable
+                    serde = CompressedSerializer(
+                        JsonPlusSerializer(),
+                        level=getValueFromConfig("checkpoints", "compression_level", 3),
+                        min_bytes=getValueFromConfig("checkpoints", "compression_min_bytes", 256),
+                    )
+                self._checkpointer_context = open_checkpoint_storage(storage, serde)
+                self._checkpointer, self._reader_checkpointer = await self._checkpointer_context.__aenter__()
+
+                # Retention works on the SQLite file directly
+                if storage.backend == "sqlite" and getValueFromConfig("checkpoints", "retention_enabled", False):
+                    self._retention = CheckpointRetention(
+                        storage.path,
+                        self._checkpointer,
+                        RetentionPolicy(
+                            keep_latest=getValueFromConfig("checkpoints", "keep_latest_per_thread", 20),
+                            idle_thread_days=getValueFromConfig("checkpoints", "idle_thread_days", 0),
+                            interval_seconds=getValueFromConfig("checkpoints", "retention_interval_seconds", 3600),
+                            initial_delay_seconds=getValueFromConfig("checkpoints", "retention_initial_delay_seconds", 600),
+                            vacuum=getValueFromConfig("checkpoints", "vacuum", "incremental"),
+                            vacuum_step_pages=getValueFromConfig("checkpoints", "vacuum_step_pages", 1000),
+                        ),
+                        on_threads_deleted=_forget_deleted_threads,
+                    )
+                    self._retention.start()
                 
-                self._model = getModel()
-                self._tools = await getTools()
+                self._model = getModel("chat")
+                # Same tool instances as the tool registry used by tool search
+                self._tools = get_registered_tools()
                 self._memory_store = get_memory_store()
-                self._agent = getAgent(self._model, self._tools, self._checkpointer, self._memory_store)
+                self._agent = getAgent(
+                    self._model,
+                    self._tools,
+                    self._checkpointer,
+                    self._memory_store,
+                    memory_model=getModel("memory"),
+                    token_counting_model=getModel("token_counting"),
+                )
 
                 
                 self._initialized = True
@@ -44,12 +100,16 @@ class _AgentManager:
         async with self._lock:
             if self._initialized and self._checkpointer_context:
                 print("Cleaning up agent resources...")
+                if self._retention:
+                    await self._retention.stop()
+                    self._retention = None
                 try:
                     await self._checkpointer_context.__aexit__(None, None, None)
                 except Exception as e:
                     print(f"Error during cleanup: {e}")
                 finally:
                     self._checkpointer = None
+                    self._reader_checkpointer = None
                     self._checkpointer_context = None
                     self._agent = None
                     self._model = None
@@ -82,6 +142,12 @@ class _AgentManager:
             raise RuntimeError("Agent not initialized. Call 'await initialize_agent()' first.")
         return self._checkpointer
     
+    @property
+    def reader_checkpointer(self):
+        if not self._initialized:
+            raise RuntimeError("Agent not initialized. Call 'await initialize_agent()' first.")
+        return self._reader_checkpointer
+
     def is_initialized(self) -> bool:
         return self._initialized
 
@@ -117,6 +183,10 @@ def get_checkpointer():
     """Get the checkpointer instance"""
     return _manager.checkpointer
 
+def get_reader_checkpointer():
+    """Get the checkpointer for reads outside the graph, on its own connection where the backend supports it"""
+    return _manager.reader_checkpointer
+
 def is_agent_initialized() -> bool:
     """Check if agent is initialized"""
     return _manager.is_initialized()
\ No newline at end of file
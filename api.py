@@ -1,14 +1,17 @@
 import json
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware 
 
+import weakref
 from contextlib import asynccontextmanager
 
 from fastapi.responses import StreamingResponse
 
+from admission_controller import OverloadedError
 from app_bootstrapper import bootstrap_app, destroy_app
-from conversation_service import chat_with_agent, chat_with_agent_stream_generator, get_all_conversation_ids, get_conversation_history_from_agent
+from conversation_service import acquire_chat_turn, admit_chat_turn, chat_with_agent, chat_with_agent_stream_generator, chat_with_agent_token_stream_generator, get_conversation_history_from_agent, get_conversations
 from dto import ChatRequest, ConversationHistory
+from tools_manager import get_tool_result_cache_stats
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -36,15 +39,55 @@ app.add_middleware(
 def index():
     return {"Hello": "World"}
 
+def _too_many_requests(e: OverloadedError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 @app.post("/api/universal-agent/chat")
 async def universal_agent_chat(request: ChatRequest) -> ConversationHistory:
-    return await chat_with_agent(request.thread_id, request.messages, request.user_id)
+    try:
+        async with admit_chat_turn(request.thread_id, request.user_id):
+            return await chat_with_agent(request.thread_id, request.messages, request.user_id)
+    except OverloadedError as e:
+        raise _too_many_requests(e)
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """Streaming response that releases its admitted turn however the response ends.
+
+    Starlette doesn't close the body iterator when the client disconnects or the
+    response is never sent, so the generator's own cleanup can't be relied on.
+    """
+
+    def __init__(self, turn, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._turn = turn
+        # Also covers a response that is dropped without ever being sent
+        weakref.finalize(self, turn.release)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # Let an interrupted graph run unwind before the thread's next turn starts
+                await self.body_iterator.aclose()
+            finally:
+                self._turn.release()
 
 @app.post("/api/universal-agent/chat/stream")
 async def universal_agent_chat_stream(request: ChatRequest) -> StreamingResponse:
+    # Admitted before the response starts, so an overload is still a plain 429
+    try:
+        turn = await acquire_chat_turn(request.thread_id, request.user_id)
+    except OverloadedError as e:
+        raise _too_many_requests(e)
+
     async def chat_stream_generator(request: ChatRequest):
+        if request.stream_mode == "tokens":
+            stream_generator = chat_with_agent_token_stream_generator
+        else:
+            stream_generator = chat_with_agent_stream_generator
         try:
-            async for chunk in chat_with_agent_stream_generator(
+            async for chunk in stream_generator(
                 thread_id=request.thread_id,
                 input_messages=request.messages,
                 user_id=request.user_id
@@ -53,7 +96,8 @@ async def universal_agent_chat_stream(request: ChatRequest) -> StreamingResponse
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
 
-    return StreamingResponse(
+    return _AdmittedStreamingResponse(
+        turn,
         chat_stream_generator(request),
         media_type="text/event-stream",
         headers={
@@ -63,20 +107,31 @@ async def universal_agent_chat_stream(request: ChatRequest) -> StreamingResponse
         )
 
 @app.get("/api/conversations")
-async def list_all_conversations(user_id: str) -> dict:
-    # try:
-        thread_ids = await get_all_conversation_ids(user_id)
-        return {"threads": thread_ids, "count": len(thread_ids)}
-    # except Exception as e:
-        # raise HTTPException(status_code=500, detail=f"Error listing conversations: {str(e)}")
+async def list_all_conversations(user_id: str, limit: int = Query(50, ge=1, le=200), cursor: str | None = None) -> dict:
+    try:
+        conversations, next_cursor = await get_conversations(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "threads": [conversation["thread_id"] for conversation in conversations],
+        "conversations": conversations,
+        "count": len(conversations),
+        "next_cursor": next_cursor,
+    }
 
 @app.get("/api/conversations/{thread_id}")
-async def get_conversation_history(thread_id: str, user_id: str) -> ConversationHistory:
+async def get_conversation_history(thread_id: str, user_id: str, limit: int | None = Query(None, ge=1, le=500), before: str | None = None) -> ConversationHistory:
     try:
-        return await get_conversation_history_from_agent(thread_id, user_id)
+        return await get_conversation_history_from_agent(thread_id, user_id, limit, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving conversation: {str(e)}")
 
+@app.get("/api/tools/cache-stats")
+async def tool_cache_stats() -> dict:
+    return get_tool_result_cache_stats()
+
 
 def run_server():
     import uvicorn
@@ -1,14 +1,30 @@
+from admission_controller import cleanup_admission_controller, initialize_admission_controller
 from agent_manager import cleanup_agent, initialize_agent
+from conversation_index import cleanup_conversation_index, initialize_conversation_index
+from embedding_cache import cleanup_embedding_cache, initialize_embedding_cache
+from history_compactor import cleanup_history_compactor, initialize_history_compactor
 from memory_store import cleanup_memory_store, initialize_memory_store
+from memory_worker import cleanup_memory_worker, initialize_memory_worker
 from tools_manager import cleanup_tools, initialize_tools
 
 
 async def bootstrap_app():
+    await initialize_embedding_cache()
     await initialize_memory_store()
+    await initialize_memory_worker()
     await initialize_tools()
     await initialize_agent()
+    await initialize_conversation_index()
+    await initialize_history_compactor()
+    await initialize_admission_controller()
 
 async def destroy_app():
+    await cleanup_history_compactor()
+    await cleanup_admission_controller()
+    # Drain pending memory creation while the model and memory store are still up
+    await cleanup_memory_worker()
+    await cleanup_conversation_index()
     await cleanup_agent()
     await cleanup_tools()
-    await cleanup_memory_store()
\ No newline at end of file
+    await cleanup_memory_store()
+    await cleanup_embedding_cache()
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""Checkpointer throughput with N concurrent conversation threads.
+
+Runs a model-free two-node graph (user message in, canned reply out) against
+each backend, with one reader per thread loading history in between turns,
+and reports turns per second and the mean history read latency.
+
+    python benchmark_checkpointer.py --threads 1 8 32 --turns 20 --backends sqlite memory
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from langchain.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from typing_extensions import Annotated, TypedDict
+
+from checkpoint_serde import CompressedSerializer
+from checkpoint_storage import StorageSettings, open_checkpoint_storage
+
+
+class BenchmarkState(TypedDict):
+    messages: Annotated[list, add_messages]
+
+
+def build_graph(checkpointer, reply_size: int):
+    async def reply(state: BenchmarkState):
+        return {"messages": [AIMessage(content="x" * reply_size)]}
+
+    builder = StateGraph(BenchmarkState)
+    builder.add_node("reply", reply)
+    builder.add_edge(START, "reply")
+    builder.add_edge("reply", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+async def run_thread(graph, reader, thread_id: str, turns: int, read_latencies: list):
+    config = {"configurable": {"thread_id": thread_id}}
+    for turn in range(turns):
+        await graph.ainvoke({"messages": [HumanMessage(content=f"turn {turn} of {thread_id}")]}, config)
+        start = time.perf_counter()
+        await reader.aget_tuple(config)
+        read_latencies.append(time.perf_counter() - start)
+
+
+async def benchmark(settings: StorageSettings, serde, threads: int, turns: int, reply_size: int) -> dict:
+    async with open_checkpoint_storage(settings, serde) as (checkpointer, reader):
+        graph = build_graph(checkpointer, reply_size)
+        read_latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(run_thread(graph, reader, f"bench_{threads}_{i}", turns, read_latencies) for i in range(threads)))
+        elapsed = time.perf_counter() - start
+    return {"turns_per_second": threads * turns / elapsed, "read_ms": 1000 * sum(read_latencies) / len(read_latencies)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--reply-size", type=int, default=2000, help="characters per assistant reply")
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "memory"])
+    parser.add_argument("--postgres-url", default=None)
+    parser.add_argument("--no-compression", action="store_true")
+    args = parser.parse_args()
+
+    serde = None if args.no_compression else CompressedSerializer(JsonPlusSerializer())
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            for threads in args.threads:
+                settings = StorageSettings(
+                    backend=backend,
+                    path=os.path.join(directory, f"bench_{threads}.db"),
+                    postgres_url=args.postgres_url,
+                )
+                result = await benchmark(settings, serde, threads, args.turns, args.reply_size)
+                print(
+                    f"{backend:>8} threads={threads:<4} "
+                    f"turns/s={result['turns_per_second']:8.1f} history read={result['read_ms']:6.2f}ms"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
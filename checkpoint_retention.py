@@ -0,0 +1,204 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+
+import aiosqlite
+
+# Offset between the UUID epoch (1582-10-15) and the Unix epoch, in 100ns intervals
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_time(checkpoint_id: str) -> float | None:
+    """Unix time encoded in a LangGraph checkpoint id (a version 6 UUID)"""
+    digits = checkpoint_id.replace("-", "")
+    if len(digits) != 32 or digits[12] != "6":
+        return None
+    timestamp = (int(digits[:12], 16) << 12) | int(digits[13:16], 16)
+    return (timestamp - _UUID_EPOCH_OFFSET) / 10_000_000
+
+
+class RetentionPolicy:
+    """How much checkpoint history is kept"""
+
+    def __init__(
+        self,
+        keep_latest: int = 20,
+        idle_thread_days: float = 0,
+        interval_seconds: float = 3600,
+        initial_delay_seconds: float = 600,
+        vacuum: str = "incremental",
+        vacuum_step_pages: int = 1000,
+    ):
+        if vacuum not in ("incremental", "none"):
+            raise ValueError(f"Unknown checkpoint vacuum mode '{vacuum}', expected 'incremental' or 'none'")
+        # Checkpoints kept per thread; the latest one holds the thread's state, so at least 1
+        self.keep_latest = max(1, keep_latest)
+        # Threads without a checkpoint for this long are deleted (0 disables)
+        self.idle_thread_days = idle_thread_days
+        self.interval_seconds = interval_seconds
+        # Leaves startup, when the database is busiest, to the server
+        self.initial_delay_seconds = initial_delay_seconds
+        self.vacuum = vacuum
+        # Pages freed per incremental vacuum step; writers get the database between steps
+        self.vacuum_step_pages = vacuum_step_pages
+
+
+class CheckpointRetention:
+    """Background pruning and compaction of the checkpoint database.
+
+    Every interval it drops all but the latest checkpoints of each thread,
+    deletes idle threads, and returns the freed pages to the filesystem in small
+    incremental vacuum steps.
+    """
+
+    def __init__(self, db_path: str, checkpointer, policy: RetentionPolicy, on_threads_deleted=None):
+        self._db_path = db_path
+        self._checkpointer = checkpointer
+        self._policy = policy
+        # Called with the deleted thread ids, e.g. to drop them from the conversation index
+        self._on_threads_deleted = on_threads_deleted
+        self._warned_auto_vacuum = False
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        await asyncio.sleep(self._policy.initial_delay_seconds)
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error during checkpoint retention: {e}")
+            await asyncio.sleep(self._policy.interval_seconds)
+
+    def _size_on_disk(self) -> int:
+        return sum(os.path.getsize(path) for path in (self._db_path, f"{self._db_path}-wal") if os.path.exists(path))
+
+    async def run_once(self) -> dict:
+        """Apply the retention policy once and report what was removed"""
+        size_before = self._size_on_disk()
+        async with aiosqlite.connect(self._db_path) as db:
+            async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'checkpoints'") as rows:
+                if not await rows.fetchone():
+                    return {"checkpoints_deleted": 0, "threads_deleted": 0, "bytes_reclaimed": 0}
+
+            idle_threads = await self._idle_threads(db)
+            for thread_id in idle_threads:
+                await self._checkpointer.adelete_thread(thread_id)
+            if idle_threads and self._on_threads_deleted:
+                await self._on_threads_deleted(idle_threads)
+
+            checkpoints_deleted = await self._prune(db)
+            await self._vacuum(db)
+
+        report = {
+            "checkpoints_deleted": checkpoints_deleted,
+            "threads_deleted": len(idle_threads),
+            "bytes_reclaimed": max(0, size_before - self._size_on_disk()),
+        }
+        print(
+            f"Checkpoint retention: deleted {report['checkpoints_deleted']} checkpoints and "
+            f"{report['threads_deleted']} idle threads, reclaimed {report['bytes_reclaimed']} bytes"
+        )
+        return report
+
+    async def _idle_threads(self, db) -> list[str]:
+        if not self._policy.idle_thread_days:
+            return []
+        cutoff = time.time() - self._policy.idle_thread_days * 86400
+        # Checkpoint ids are time ordered, so the max id of a thread is its last activity
+        async with db.execute("SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id") as rows:
+            latest = await rows.fetchall()
+        return [thread_id for thread_id, checkpoint_id in latest if (checkpoint_time(checkpoint_id) or time.time()) < cutoff]
+
+    async def _prune(self, db) -> int:
+        """Delete all but the latest checkpoints of every thread, with their pending writes"""
+        cursor = await db.execute(
+            """
+            DELETE FROM checkpoints WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, ROW_NUMBER() OVER (
+                        PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                    ) AS position
+                    FROM checkpoints
+                ) WHERE position > ?
+            )
+            """,
+            (self._policy.keep_latest,),
+        )
+        deleted = cursor.rowcount
+        await db.execute(
+            """
+            DELETE FROM writes WHERE NOT EXISTS (
+                SELECT 1 FROM checkpoints
+                WHERE checkpoints.thread_id = writes.thread_id
+                    AND checkpoints.checkpoint_ns = writes.checkpoint_ns
+                    AND checkpoints.checkpoint_id = writes.checkpoint_id
+            )
+            """
+        )
+        await db.commit()
+        return deleted
+
+    async def _vacuum(self, db):
+        if self._policy.vacuum == "none":
+            return
+        async with db.execute("PRAGMA auto_vacuum") as rows:
+            auto_vacuum = (await rows.fetchone())[0]
+        if auto_vacuum != 2:
+            # Switching to incremental auto-vacuum takes a full VACUUM, which locks the
+            # database for its whole duration; that is a maintenance step, not done here
+            if not self._warned_auto_vacuum:
+                print(
+                    f"Checkpoint database {self._db_path} doesn't use incremental auto-vacuum, freed space "
+                    f"is reused but not returned. Stop the server and run "
+                    f"'python checkpoint_retention.py {self._db_path}' once to convert it."
+                )
+                self._warned_auto_vacuum = True
+            return
+
+        async with db.execute("PRAGMA freelist_count") as rows:
+            free_pages = (await rows.fetchone())[0]
+        step = self._policy.vacuum_step_pages
+        for _ in range(-(-free_pages // step)):
+            # Each step is a short write transaction of its own. The pragma frees one page
+            # per statement step, and only executescript steps it to completion.
+            await db.executescript(f"PRAGMA incremental_vacuum({step});")
+            await asyncio.sleep(0.05)
+        # Move the WAL back into the database file and truncate it
+        await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def convert_to_incremental_vacuum(db_path: str):
+    """One-time maintenance: switch the database to incremental auto-vacuum with a full VACUUM.
+
+    Holds an exclusive lock on the database for as long as the VACUUM runs, so run it
+    while the server is stopped.
+    """
+    db = sqlite3.connect(db_path)
+    try:
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python checkpoint_retention.py <checkpoints.db>")
+        sys.exit(1)
+    size_before = os.path.getsize(sys.argv[1])
+    convert_to_incremental_vacuum(sys.argv[1])
+    print(f"Converted {sys.argv[1]} to incremental auto-vacuum, {size_before - os.path.getsize(sys.argv[1])} bytes reclaimed")
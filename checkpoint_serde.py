@@ -0,0 +1,30 @@
+import zstandard
+
+# Type prefix of compressed values; rows without it are read as they are
+_ZSTD_PREFIX = "zstd:"
+
+
+class CompressedSerializer:
+    """Checkpoint serializer that zstd-compresses the output of another serializer.
+
+    Values smaller than `min_bytes` are stored uncompressed, and values written
+    before compression was enabled are read transparently.
+    """
+
+    def __init__(self, serde, level: int = 3, min_bytes: int = 256):
+        self._serde = serde
+        self._min_bytes = min_bytes
+        self._level = level
+
+    def dumps_typed(self, obj) -> tuple[str, bytes]:
+        type_, data = self._serde.dumps_typed(obj)
+        if len(data) < self._min_bytes:
+            return type_, data
+        # Compressors are not thread safe, and the checkpointer may serialize from several threads
+        return _ZSTD_PREFIX + type_, zstandard.ZstdCompressor(level=self._level).compress(data)
+
+    def loads_typed(self, data: tuple[str, bytes]):
+        type_, payload = data
+        if type_.startswith(_ZSTD_PREFIX):
+            return self._serde.loads_typed((type_[len(_ZSTD_PREFIX):], zstandard.ZstdDecompressor().decompress(payload)))
+        return self._serde.loads_typed(data)
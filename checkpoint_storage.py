@@ -0,0 +1,90 @@
+from contextlib import asynccontextmanager
+
+import aiosqlite
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+CHECKPOINT_BACKENDS = ("sqlite", "postgres", "memory")
+
+
+class StorageSettings:
+    """Which checkpoint backend to use and how to tune it"""
+
+    def __init__(
+        self,
+        backend: str = "sqlite",
+        path: str = "checkpoints.db",
+        postgres_url: str | None = None,
+        synchronous: str = "NORMAL",
+        cache_size_mb: int = 64,
+        mmap_size_mb: int = 256,
+        busy_timeout_ms: int = 5000,
+    ):
+        if backend not in CHECKPOINT_BACKENDS:
+            raise ValueError(f"Unknown checkpoint backend '{backend}', expected one of {CHECKPOINT_BACKENDS}")
+        if backend == "postgres" and not postgres_url:
+            raise ValueError("The postgres checkpoint backend needs checkpoints.postgres_url")
+        self.backend = backend
+        self.path = path
+        self.postgres_url = postgres_url
+        self.synchronous = synchronous
+        self.cache_size_mb = cache_size_mb
+        self.mmap_size_mb = mmap_size_mb
+        self.busy_timeout_ms = busy_timeout_ms
+
+
+async def _tune_sqlite(conn: aiosqlite.Connection, settings: StorageSettings):
+    # WAL lets the reader connection load state while a turn is being written;
+    # with WAL, synchronous=NORMAL only fsyncs at WAL checkpoints and is still crash safe
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute(f"PRAGMA synchronous={settings.synchronous}")
+    # Negative cache_size is in KiB
+    await conn.execute(f"PRAGMA cache_size=-{settings.cache_size_mb * 1024}")
+    await conn.execute(f"PRAGMA mmap_size={settings.mmap_size_mb * 1024 * 1024}")
+    await conn.execute(f"PRAGMA busy_timeout={settings.busy_timeout_ms}")
+    await conn.execute("PRAGMA temp_store=MEMORY")
+
+
+@asynccontextmanager
+async def _open_sqlite(settings: StorageSettings, serde):
+    async with aiosqlite.connect(settings.path) as writer_conn:
+        await _tune_sqlite(writer_conn, settings)
+        writer = AsyncSqliteSaver(writer_conn, serde=serde)
+        await writer.setup()
+        # A separate read-only connection, so history reads don't queue behind
+        # the writer connection's lock
+        async with aiosqlite.connect(f"file:{settings.path}?mode=ro", uri=True) as reader_conn:
+            await _tune_sqlite(reader_conn, settings)
+            reader = AsyncSqliteSaver(reader_conn, serde=serde)
+            # The writer already created the tables
+            reader.is_setup = True
+            yield writer, reader
+
+
+@asynccontextmanager
+async def _open_postgres(settings: StorageSettings, serde):
+    try:
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+    except ImportError:
+        raise ImportError("The postgres checkpoint backend needs the langgraph-checkpoint-postgres package")
+    async with AsyncPostgresSaver.from_conn_string(settings.postgres_url) as checkpointer:
+        if serde is not None:
+            checkpointer.serde = serde
+        await checkpointer.setup()
+        # Postgres handles concurrent readers itself
+        yield checkpointer, checkpointer
+
+
+@asynccontextmanager
+async def open_checkpoint_storage(settings: StorageSettings, serde=None):
+    """Open the configured checkpoint backend, yielding (checkpointer, reader checkpointer)"""
+    if settings.backend == "sqlite":
+        async with _open_sqlite(settings, serde) as checkpointers:
+            yield checkpointers
+    elif settings.backend == "postgres":
+        async with _open_postgres(settings, serde) as checkpointers:
+            yield checkpointers
+    else:
+        # Not persisted; for development and benchmarks
+        checkpointer = InMemorySaver(serde=serde)
+        yield checkpointer, checkpointer
@@ -0,0 +1,229 @@
+import asyncio
+import base64
+import time
+from datetime import datetime
+
+import aiosqlite
+from langchain.messages import HumanMessage
+
+from utils import getValueFromConfig
+
+_TITLE_MAX_CHARS = 80
+
+
+def _encode_cursor(updated_at: float, thread_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at!r}|{thread_id}".encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple[float, str]:
+    try:
+        updated_at, thread_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        return float(updated_at), thread_id
+    except Exception:
+        raise ValueError("Invalid conversation cursor")
+
+
+def conversation_title(messages) -> str | None:
+    """Title of a conversation: the start of its first user message"""
+    for message in messages:
+        if isinstance(message, HumanMessage) and isinstance(message.content, str) and message.content.strip():
+            title = " ".join(message.content.split())
+            return title if len(title) <= _TITLE_MAX_CHARS else title[:_TITLE_MAX_CHARS - 3] + "..."
+    return None
+
+
+class _ConversationIndex:
+    """Internal conversation index (not exposed directly)
+
+    Keeps one row per (user, thread) next to the checkpoints, updated on every
+    turn, so conversations can be listed per user without reading checkpoints.
+    Users whose threads predate the index are backfilled on their first listing.
+    """
+
+    def __init__(self):
+        self._db = None
+        self._db_path = "checkpoints.db"
+        # Users already backfilled in this process, saves a lookup per listing
+        self._backfilled = set()
+        self._initialized = False
+        self._lock = asyncio.Lock()
+        self._backfill_lock = asyncio.Lock()
+
+    async def initialize(self):
+        """Initialize the conversation index"""
+        async with self._lock:
+            if not self._initialized:
+                default_path = getValueFromConfig("checkpoints", "path", self._db_path)
+                self._db_path = getValueFromConfig("conversations", "index_db_path", default_path)
+                self._db = await aiosqlite.connect(self._db_path)
+                await self._db.executescript(
+                    """
+                    PRAGMA journal_mode=WAL;
+                    CREATE TABLE IF NOT EXISTS conversations (
+                        user_id TEXT NOT NULL,
+                        thread_id TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL,
+                        message_count INTEGER NOT NULL DEFAULT 0,
+                        title TEXT,
+                        PRIMARY KEY (user_id, thread_id)
+                    );
+                    CREATE INDEX IF NOT EXISTS conversations_by_user_updated
+                        ON conversations (user_id, updated_at DESC, thread_id DESC);
+                    -- Checkpoint thread id, for deleting the threads retention removed
+                    CREATE INDEX IF NOT EXISTS conversations_by_checkpoint_thread
+                        ON conversations (user_id || '_' || thread_id);
+                    CREATE TABLE IF NOT EXISTS conversation_index_backfills (
+                        user_id TEXT PRIMARY KEY
+                    );
+                    """
+                )
+                await self._db.commit()
+                self._initialized = True
+                print("Conversation index initialized successfully!")
+
+    async def cleanup(self):
+        """Cleanup the conversation index"""
+        async with self._lock:
+            if self._initialized:
+                await self._db.close()
+                self._db = None
+                self._backfilled.clear()
+                self._initialized = False
+                print("Conversation index cleaned up successfully!")
+
+    async def record_turn(self, user_id: str, thread_id: str, message_count: int, title: str | None):
+        """Create or update the conversation's row after a turn"""
+        now = time.time()
+        await self._db.execute(
+            """
+            INSERT INTO conversations (user_id, thread_id, created_at, updated_at, message_count, title)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, thread_id) DO UPDATE SET
+                updated_at = excluded.updated_at,
+                message_count = excluded.message_count,
+                title = COALESCE(conversations.title, excluded.title)
+            """,
+            (user_id, thread_id, now, now, message_count, title),
+        )
+        await self._db.commit()
+
+    async def forget_threads(self, full_thread_ids: list[str]):
+        """Drop deleted threads, given as checkpoint thread ids ("<user_id>_<thread_id>")"""
+        # Matches conversations_by_checkpoint_thread; user ids may contain "_", so the id can't be split
+        await self._db.executemany(
+            "DELETE FROM conversations WHERE user_id || '_' || thread_id = ?",
+            [(full_thread_id,) for full_thread_id in full_thread_ids],
+        )
+        await self._db.commit()
+
+    async def list_conversations(self, user_id: str, checkpointer, limit: int, cursor: str | None = None) -> tuple[list[dict], str | None]:
+        """A page of the user's conversations, most recently updated first, and the cursor of the next page"""
+        await self._ensure_backfilled(user_id, checkpointer)
+
+        if cursor:
+            updated_at, thread_id = _decode_cursor(cursor)
+            query = """
+                SELECT thread_id, created_at, updated_at, message_count, title FROM conversations
+                WHERE user_id = ? AND (updated_at < ? OR (updated_at = ? AND thread_id < ?))
+                ORDER BY updated_at DESC, thread_id DESC LIMIT ?
+            """
+            params = (user_id, updated_at, updated_at, thread_id, limit + 1)
+        else:
+            query = """
+                SELECT thread_id, created_at, updated_at, message_count, title FROM conversations
+                WHERE user_id = ?
+                ORDER BY updated_at DESC, thread_id DESC LIMIT ?
+            """
+            params = (user_id, limit + 1)
+
+        async with self._db.execute(query, params) as rows:
+            rows = await rows.fetchall()
+        conversations = [
+            {"thread_id": row[0], "created_at": row[1], "updated_at": row[2], "message_count": row[3], "title": row[4]}
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = conversations[-1]
+            next_cursor = _encode_cursor(last["updated_at"], last["thread_id"])
+        return conversations, next_cursor
+
+    async def _ensure_backfilled(self, user_id: str, checkpointer):
+        """Index the user's threads that were checkpointed before the index existed"""
+        if user_id in self._backfilled:
+            return
+        async with self._backfill_lock:
+            async with self._db.execute("SELECT 1 FROM conversation_index_backfills WHERE user_id = ?", (user_id,)) as rows:
+                done = await rows.fetchone()
+            if not done:
+                await self._backfill(user_id, checkpointer)
+                await self._db.execute("INSERT OR IGNORE INTO conversation_index_backfills (user_id) VALUES (?)", (user_id,))
+                await self._db.commit()
+            self._backfilled.add(user_id)
+
+    async def _backfill(self, user_id: str, checkpointer):
+        async with self._db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'checkpoints'") as rows:
+            if not await rows.fetchone():
+                return
+
+        # Checkpoint thread ids are "<user_id>_<thread_id>"; a key range over the
+        # primary key finds the user's threads without touching anyone else's
+        prefix = f"{user_id}_"
+        async with self._db.execute(
+            "SELECT DISTINCT thread_id FROM checkpoints WHERE thread_id >= ? AND thread_id < ?",
+            (prefix, prefix + "\uffff"),
+        ) as rows:
+            full_thread_ids = [row[0] for row in await rows.fetchall()]
+
+        for full_thread_id in full_thread_ids:
+            checkpoint_tuple = await checkpointer.aget_tuple({"configurable": {"thread_id": full_thread_id}})
+            if checkpoint_tuple is None:
+                continue
+            checkpoint = checkpoint_tuple.checkpoint
+            messages = checkpoint.get("channel_values", {}).get("messages", [])
+            updated_at = _checkpoint_time(checkpoint)
+            await self._db.execute(
+                """
+                INSERT OR IGNORE INTO conversations (user_id, thread_id, created_at, updated_at, message_count, title)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, full_thread_id[len(prefix):], updated_at, updated_at, len(messages), conversation_title(messages)),
+            )
+        await self._db.commit()
+        print(f"Backfilled {len(full_thread_ids)} conversations of user {user_id}")
+
+    def is_initialized(self) -> bool:
+        return self._initialized
+
+
+def _checkpoint_time(checkpoint: dict) -> float:
+    try:
+        return datetime.fromisoformat(checkpoint["ts"]).timestamp()
+    except (KeyError, ValueError):
+        return time.time()
+
+
+# Module-level singleton instance
+_manager = _ConversationIndex()
+
+# Public API
+async def initialize_conversation_index():
+    await _manager.initialize()
+
+async def cleanup_conversation_index():
+    await _manager.cleanup()
+
+async def record_conversation_turn(user_id: str, thread_id: str, messages):
+    """Update the conversation index with the thread's messages after a turn"""
+    if _manager.is_initialized():
+        await _manager.record_turn(user_id, thread_id, len(messages), conversation_title(messages))
+
+async def forget_conversations(full_thread_ids: list[str]):
+    """Remove threads deleted from the checkpointer from the conversation index"""
+    if _manager.is_initialized():
+        await _manager.forget_threads(full_thread_ids)
+
+async def list_conversations(user_id: str, checkpointer, limit: int = 50, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """List a page of the user's conversations, most recently updated first"""
+    return await _manager.list_conversations(user_id, checkpointer, limit, cursor)
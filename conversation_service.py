@@ -1,25 +1,42 @@
-from langchain.messages import HumanMessage
+from langchain.messages import AIMessage, HumanMessage, ToolMessage
 
-from agent_manager import get_agent, get_checkpointer
-from dto import ConversationHistory, MessageDetail
+from admission_controller import acquire_turn, admit_turn
+from agent_manager import get_agent, get_checkpointer, get_reader_checkpointer
+from conversation_index import list_conversations, record_conversation_turn
+from dto import ChatStreamEvent, ConversationHistory, MessageDetail
+from history_compactor import schedule_compaction
+from history_cache import get_cached_history, get_history_version, invalidate_history, put_cached_history
 from utils import MessageConverter
 
 async def get_state(config: dict) -> dict:
     return await get_agent().aget_state(config)
 
+def admit_chat_turn(thread_id: str, user_id: str):
+    """Wait for the thread's previous turn and a free graph slot; raises OverloadedError when busy"""
+    return admit_turn(f"{user_id}_{thread_id}")
+
+async def acquire_chat_turn(thread_id: str, user_id: str):
+    """Like admit_chat_turn, returning a turn to release() once the streamed response is done"""
+    return await acquire_turn(f"{user_id}_{thread_id}")
+
 async def chat_with_agent(thread_id: str, input_messages: list[MessageDetail], user_id: str) -> ConversationHistory:
     # Use thread_id from request for conversation tracking
     langchain_messages = MessageConverter.raw_to_langchain(input_messages)
     config = {"configurable": {"thread_id": f"{user_id}_{thread_id}", "user_id": user_id}}
-    result = await get_agent().ainvoke({"messages": langchain_messages}, config=config)
-    # Get the state from the checkpointer
-    state = await get_state(config)
-    
-    if not state or not state.values.get("messages"):
+    try:
+        result = await get_agent().ainvoke({"messages": langchain_messages}, config=config)
+    finally:
+        # Also after a failed run, which may have checkpointed part of the turn
+        invalidate_history(config["configurable"]["thread_id"])
+    await record_conversation_turn(user_id, thread_id, result["messages"])
+    schedule_compaction(user_id, thread_id, result)
+
+    # ainvoke already returned the final state, no need to load it again
+    if not result.get("messages"):
         return ConversationHistory(thread_id=thread_id, messages=[], user_id=user_id)
 
     filtered_messages = []
-    for msg in state.values["messages"][::-1]:
+    for msg in result["messages"][::-1]:
         if isinstance(msg, HumanMessage):
             break
         filtered_messages.append(msg)
@@ -32,45 +49,99 @@ async def chat_with_agent_stream_generator(thread_id: str, input_messages: list[
     langchain_messages = MessageConverter.raw_to_langchain(input_messages)
     config = {"configurable": {"thread_id": f"{user_id}_{thread_id}", "user_id": user_id}}
     
-    async for chunk in get_agent().astream({"messages": langchain_messages}, config, stream_mode="updates"):
-        messages = []
-        if "llm_call" in chunk:
-            messages = chunk["llm_call"]["messages"]
-        elif "tool_node" in chunk:
-            messages = chunk["tool_node"]["messages"]
-        
-        if len(messages) > 0:
-            messages = MessageConverter.langchain_to_raw(messages)
-            conv_history = ConversationHistory(thread_id=thread_id, messages=messages, user_id=user_id)
-            yield conv_history
-    
-async def get_all_conversation_ids(user_id: str) ->list[str]:
-    thread_ids = set()
-    prefix = f"{user_id}_"
-    # List all checkpoints and extract unique thread_ids
-    async for checkpoint_tuple in get_checkpointer().alist(None):
-        config = checkpoint_tuple.config
-        if config and "configurable" in config and "thread_id" in config["configurable"]:
-            full_thread_id = config["configurable"]["thread_id"]
-            # Only include threads that belong to this user
-            if full_thread_id.startswith(prefix):
-                # Strip the user_id prefix to return just the thread_id
-                thread_ids.add(full_thread_id[len(prefix):])
+    try:
+        async for chunk in get_agent().astream({"messages": langchain_messages}, config, stream_mode="updates"):
+            messages = []
+            if "llm_call" in chunk:
+                messages = chunk["llm_call"]["messages"]
+            elif "tool_node" in chunk:
+                messages = chunk["tool_node"]["messages"]
 
+            if len(messages) > 0:
+                messages = MessageConverter.langchain_to_raw(messages)
+                conv_history = ConversationHistory(thread_id=thread_id, messages=messages, user_id=user_id)
+                yield conv_history
+    finally:
+        # Also when the stream is aborted, which may have checkpointed part of the turn
+        invalidate_history(config["configurable"]["thread_id"])
+    state = await get_state(config)
+    await record_conversation_turn(user_id, thread_id, state.values.get("messages", []))
+    schedule_compaction(user_id, thread_id, state.values)
     
-    return sorted(list(thread_ids))
-
-async def get_conversation_history_from_agent(thread_id: str, user_id: str) -> ConversationHistory:
+async def chat_with_agent_token_stream_generator(thread_id: str, input_messages: list[MessageDetail], user_id: str):
+    """Stream the reply as token deltas, with an event per tool call and tool result"""
+    langchain_messages = MessageConverter.raw_to_langchain(input_messages)
     config = {"configurable": {"thread_id": f"{user_id}_{thread_id}", "user_id": user_id}}
-    
-    # Get the state from the checkpointer
+
+    try:
+        async for mode, chunk in get_agent().astream({"messages": langchain_messages}, config, stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                message, metadata = chunk
+                # Only the reply model streams to the client, not the memory or summary calls
+                if metadata.get("langgraph_node") == "llm_call" and isinstance(message.content, str) and message.content:
+                    yield ChatStreamEvent(type="token", thread_id=thread_id, user_id=user_id, message_id=message.id, content=message.content)
+            elif "llm_call" in chunk:
+                # Tool calls are sent once complete rather than as partial argument chunks
+                for message in chunk["llm_call"]["messages"]:
+                    if isinstance(message, AIMessage) and message.tool_calls:
+                        yield ChatStreamEvent(type="tool_call", thread_id=thread_id, user_id=user_id, message_id=message.id, tool_calls=message.tool_calls)
+            elif "tool_node" in chunk:
+                for message in chunk["tool_node"]["messages"]:
+                    if isinstance(message, ToolMessage):
+                        yield ChatStreamEvent(type="tool_result", thread_id=thread_id, user_id=user_id, message_id=message.id, content=str(message.content), tool_call_id=message.tool_call_id)
+    finally:
+        invalidate_history(config["configurable"]["thread_id"])
     state = await get_state(config)
-    
-    if not state or not state.values.get("messages"):
+    await record_conversation_turn(user_id, thread_id, state.values.get("messages", []))
+    schedule_compaction(user_id, thread_id, state.values)
+
+async def get_conversations(user_id: str, limit: int = 50, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """A page of the user's conversations from the conversation index, most recently updated first"""
+    return await list_conversations(user_id, get_checkpointer(), limit, cursor)
+
+def _history_page(messages: list[MessageDetail], positions: dict, limit: int | None, before: str | None) -> tuple[list[MessageDetail], str | None]:
+    """The `limit` messages before the `before` cursor, and the cursor of the page before them"""
+    end = len(messages)
+    if before:
+        if before.startswith("@"):
+            # Position cursor, for messages stored before they had ids
+            end = int(before[1:]) if before[1:].isdigit() else None
+        else:
+            end = positions.get(before)
+        if end is None or end > len(messages):
+            raise ValueError(f"Unknown message cursor '{before}'")
+    start = 0 if limit is None else max(0, end - limit)
+    next_cursor = (messages[start].id or f"@{start}") if start > 0 else None
+    return messages[start:end], next_cursor
+
+async def _load_history(full_thread_id: str, config: dict):
+    """Converted messages of the thread, their positions by id and the summary, cached until the next write"""
+    history = get_cached_history(full_thread_id)
+    if history is not None:
+        return history
+
+    version = get_history_version(full_thread_id)
+    # Read the latest checkpoint on the reader connection, so history requests
+    # don't wait behind turns being written
+    checkpoint_tuple = await get_reader_checkpointer().aget_tuple(config)
+    values = checkpoint_tuple.checkpoint["channel_values"] if checkpoint_tuple else {}
+    messages = MessageConverter.langchain_to_raw(values.get("messages", []))
+    positions = {message.id: position for position, message in enumerate(messages) if message.id}
+    history = (messages, positions, values.get("summary"))
+    put_cached_history(full_thread_id, version, history)
+    return history
+
+async def get_conversation_history_from_agent(thread_id: str, user_id: str, limit: int | None = None, before: str | None = None) -> ConversationHistory:
+    """A page of the conversation: the `limit` messages before message `before`, or the whole thread"""
+    config = {"configurable": {"thread_id": f"{user_id}_{thread_id}", "user_id": user_id}}
+    messages, positions, summary = await _load_history(config["configurable"]["thread_id"], config)
+
+    if not messages:
         return ConversationHistory(thread_id=thread_id, messages=[], user_id=user_id)
-    
-    # Extract and format messages
-    messages = MessageConverter.langchain_to_raw(state.values["messages"])
-    
-    return ConversationHistory(thread_id=thread_id, messages=messages, user_id=user_id)
-    
\ No newline at end of file
+
+    page, next_cursor = _history_page(messages, positions, limit, before)
+    if summary and next_cursor is None:
+        # Older turns were compacted into the summary, which leads the first page
+        page = [MessageDetail(role="system", content=f"Summary of the earlier conversation: {summary}")] + page
+
+    return ConversationHistory(thread_id=thread_id, messages=page, user_id=user_id, next_cursor=next_cursor)
@@ -15,11 +15,26 @@ class ChatRequest(BaseModel):
     messages: list[MessageDetail]
     thread_id: str
     user_id: str
+    # Streaming only: whole messages per graph step, or token deltas plus tool events
+    stream_mode: Literal["messages", "tokens"] = "messages"
 
 class ConversationHistory(BaseModel):
     thread_id: str
     messages: list[MessageDetail]
     user_id: str
+    # Cursor for the page of older messages, when a paginated history has more
+    next_cursor: Optional[str] = None
+
+class ChatStreamEvent(BaseModel):
+    """A single event of a token-streamed chat response"""
+    type: Literal["token", "tool_call", "tool_result"]
+    thread_id: str
+    user_id: str
+    message_id: Optional[str] = None
+    # Content delta for "token", result content for "tool_result"
+    content: Optional[str] = None
+    tool_calls: Optional[List[Dict[str, Any]]] = None
+    tool_call_id: Optional[str] = None
 
 class A2ARequest(BaseModel):
     """
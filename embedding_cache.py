@@ -0,0 +1,244 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+
+from utils import getValueFromConfig, run_blocking
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings of one model served through the shared embedding cache"""
+
+    def __init__(self, cache, model: str):
+        self._cache = cache
+        self.model = model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._cache.embed(self.model, texts)
+
+    # Queries are mostly unique user text, so they are only kept in memory
+    def embed_query(self, text: str) -> list[float]:
+        return self._cache.embed(self.model, [text], persist=False)[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self._cache.aembed(self.model, texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self._cache.aembed(self.model, [text], persist=False))[0]
+
+
+class _EmbeddingCache:
+    """Internal embedding cache (not exposed directly)
+
+    Embeddings are content addressed by (model, sha256(text)) and served from an
+    in-process LRU, so the same text is embedded once per model across memories,
+    tool descriptions and queries. Document embeddings are also kept in a SQLite
+    file, capped at `disk_max_entries` rows, so they survive restarts.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._max_entries = 10_000
+        self._max_disk_entries = 100_000
+        # Misses currently being embedded, so concurrent lookups share one request
+        self._inflight = {}
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._db_path = "./embedding_cache.db"
+        self._initialized = False
+        self._lock = asyncio.Lock()
+
+    async def initialize(self):
+        """Initialize the embedding cache"""
+        async with self._lock:
+            if not self._initialized:
+                self._max_entries = getValueFromConfig("embeddings", "cache_max_entries", self._max_entries)
+                self._max_disk_entries = getValueFromConfig("embeddings", "disk_max_entries", self._max_disk_entries)
+                self._db = await run_blocking(self._open_db)
+                self._initialized = True
+                print("Embedding cache initialized successfully!")
+
+    def _open_db(self):
+        db = sqlite3.connect(self._db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        db.commit()
+        return db
+
+    async def cleanup(self):
+        """Cleanup the embedding cache"""
+        async with self._lock:
+            if self._initialized:
+                with self._db_lock:
+                    self._db.close()
+                self._db = None
+                self._clients.clear()
+                with self._lru_lock:
+                    self._lru.clear()
+                self._initialized = False
+                print("Embedding cache cleaned up successfully!")
+
+    def get_embeddings(self, model: str) -> CachedEmbeddings:
+        return CachedEmbeddings(self, model)
+
+    def _client(self, model: str) -> OllamaEmbeddings:
+        if model not in self._clients:
+            self._clients[model] = OllamaEmbeddings(model=model)
+        return self._clients[model]
+
+    @staticmethod
+    def _key(model: str, text: str) -> tuple[str, str]:
+        return model, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lru_get(self, key):
+        with self._lru_lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+            return vector
+
+    def _lru_put(self, key, vector):
+        with self._lru_lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self._max_entries:
+                self._lru.popitem(last=False)
+
+    def _db_get(self, keys: list[tuple[str, str]]) -> dict:
+        found = {}
+        with self._db_lock:
+            for model, text_hash in keys:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND text_hash = ?",
+                    (model, text_hash),
+                ).fetchone()
+                if row:
+                    found[(model, text_hash)] = array("f", row[0]).tolist()
+        return found
+
+    def _db_put(self, entries: dict):
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model, text_hash, array("f", vector).tobytes()) for (model, text_hash), vector in entries.items()],
+            )
+            # Rows get increasing rowids as they are written, so this drops the oldest writes
+            self._db.execute(
+                "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                (self._max_disk_entries,),
+            )
+            self._db.commit()
+
+    def _lookup(self, keys: list[tuple[str, str]]) -> dict:
+        """Resolve keys from the LRU, then from disk; misses are left out"""
+        found = {}
+        for key in keys:
+            vector = self._lru_get(key)
+            if vector is not None:
+                found[key] = vector
+        disk_keys = [key for key in keys if key not in found]
+        if disk_keys and self._db:
+            for key, vector in self._db_get(disk_keys).items():
+                self._lru_put(key, vector)
+                found[key] = vector
+        return found
+
+    def embed(self, model: str, texts: list[str], persist: bool = True) -> list[list[float]]:
+        """Embed texts, serving cached vectors where possible (blocking)"""
+        keys = [self._key(model, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = self._client(model).embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            for key, vector in computed.items():
+                self._lru_put(key, vector)
+            if persist and self._db:
+                self._db_put(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def _embed_batch(self, model: str, missing: dict, futures: dict, persist: bool) -> dict:
+        """Embed the missing texts and resolve the futures other requests are waiting on"""
+        try:
+            vectors = await self._client(model).aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            for key, vector in computed.items():
+                self._lru_put(key, vector)
+                futures[key].set_result(vector)
+            if persist and self._db:
+                await run_blocking(self._db_put, computed)
+            return computed
+        except BaseException as e:
+            error = e if isinstance(e, Exception) else RuntimeError("Embedding request was cancelled")
+            for future in futures.values():
+                if not future.done():
+                    # Waiters get the error and may retry, rather than a cancellation they didn't cause
+                    future.set_exception(error)
+                    # Mark the exception as retrieved in case nobody joined this request
+                    future.exception()
+            raise
+        finally:
+            for key in futures:
+                self._inflight.pop(key, None)
+
+    async def aembed(self, model: str, texts: list[str], persist: bool = True) -> list[list[float]]:
+        """Embed texts, serving cached vectors where possible"""
+        keys = [self._key(model, text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+
+        found = {}
+        for key in unique_keys:
+            vector = self._lru_get(key)
+            if vector is not None:
+                found[key] = vector
+        disk_keys = [key for key in unique_keys if key not in found and key not in self._inflight]
+        if disk_keys and self._db:
+            found.update(await run_blocking(self._lookup, disk_keys))
+
+        # Join requests already embedding the same text, and embed the rest in one batch
+        waiting = {key: self._inflight[key] for key in unique_keys if key not in found and key in self._inflight}
+        missing = {key: text for key, text in zip(keys, texts) if key not in found and key not in waiting}
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in missing}
+            self._inflight.update(futures)
+            batch = asyncio.create_task(self._embed_batch(model, missing, futures, persist))
+            # Don't leave a failure unretrieved when every request gave up on the batch
+            batch.add_done_callback(lambda task: task.cancelled() or task.exception())
+            # Other requests wait on this batch, so cancelling this one must not cancel it
+            found.update(await asyncio.shield(batch))
+        for key, future in waiting.items():
+            found[key] = await asyncio.shield(future)
+
+        return [found[key] for key in keys]
+
+
+# Module-level singleton instance
+_manager = _EmbeddingCache()
+
+# Public API
+async def initialize_embedding_cache():
+    await _manager.initialize()
+
+async def cleanup_embedding_cache():
+    await _manager.cleanup()
+
+def get_embeddings(model: str) -> CachedEmbeddings:
+    """Get an embeddings instance for the model that goes through the shared cache"""
+    return _manager.get_embeddings(model)
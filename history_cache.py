@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+
+from utils import getValueFromConfig
+
+
+class _HistoryCache:
+    """Internal cache of converted conversation histories (not exposed directly)
+
+    Keeps the converted messages of recently opened threads, so paging through a
+    conversation doesn't reload and reconvert the whole thread for every page.
+    Every write to a thread gives it a new version; a history loaded before that
+    is never cached. Versions are only remembered for recently written threads;
+    forgetting one raises the version of every thread not remembered, so loads
+    that were in flight at that point aren't cached either.
+    """
+
+    def __init__(self):
+        # checkpoint thread id -> converted history, least recently used first
+        self._entries = OrderedDict()
+        # checkpoint thread id -> write version of recently written threads, oldest first
+        self._versions = OrderedDict()
+        # Version of the threads not in _versions: the newest version forgotten so far
+        self._forgotten_version = 0
+        self._last_version = 0
+        self._max_entries = None
+        self._lock = threading.Lock()
+
+    def _capacity(self) -> int:
+        if self._max_entries is None:
+            self._max_entries = getValueFromConfig("conversations", "history_cache_max_threads", 256)
+        return self._max_entries
+
+    def _version(self, thread_id: str) -> int:
+        return self._versions.get(thread_id, self._forgotten_version)
+
+    def _forget_version(self, thread_id: str):
+        version = self._versions.pop(thread_id, None)
+        if version is not None:
+            self._forgotten_version = max(self._forgotten_version, version)
+
+    def version(self, thread_id: str) -> int:
+        with self._lock:
+            return self._version(thread_id)
+
+    def get(self, thread_id: str):
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is not None:
+                self._entries.move_to_end(thread_id)
+            return entry
+
+    def put(self, thread_id: str, version: int, history):
+        with self._lock:
+            if self._version(thread_id) != version:
+                # The thread was written while this history was loading
+                return
+            self._entries[thread_id] = history
+            self._entries.move_to_end(thread_id)
+            while len(self._entries) > self._capacity():
+                evicted_thread_id, _ = self._entries.popitem(last=False)
+                self._forget_version(evicted_thread_id)
+
+    def invalidate(self, thread_id: str):
+        with self._lock:
+            self._last_version += 1
+            self._versions[thread_id] = self._last_version
+            self._versions.move_to_end(thread_id)
+            self._entries.pop(thread_id, None)
+            while len(self._versions) > self._capacity():
+                self._forget_version(next(iter(self._versions)))
+
+
+# Module-level singleton instance
+_manager = _HistoryCache()
+
+# Public API
+def get_history_version(thread_id: str) -> int:
+    """Current write version of the thread; pass it back to put_cached_history"""
+    return _manager.version(thread_id)
+
+def get_cached_history(thread_id: str):
+    """Get the cached history of the thread, or None"""
+    return _manager.get(thread_id)
+
+def put_cached_history(thread_id: str, version: int, history):
+    """Cache a converted history loaded at the given write version"""
+    _manager.put(thread_id, version, history)
+
+def invalidate_history(thread_id: str):
+    """Drop the cached history after the thread was written or deleted"""
+    _manager.invalidate(thread_id)
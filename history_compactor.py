@@ -0,0 +1,143 @@
+import asyncio
+
+from langchain.messages import AIMessage, AnyMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+
+from admission_controller import OverloadedError, admit_turn
+from agent_manager import get_agent
+from history_cache import invalidate_history
+from model import getModel
+from prompt_templates import CONVERSATION_SUMMARY_PROMPT
+from token_counter import estimate_tokens
+from utils import getValueFromConfig
+
+
+class _HistoryCompactor:
+    """Internal history compactor (not exposed directly)
+
+    Folds the older turns of long threads into a running summary once a turn has
+    been answered, so the summarization call never delays a response. It runs as
+    a turn of its own under the thread's lock, so it can't race the next message.
+    """
+
+    def __init__(self):
+        self._model = None
+        self._max_tokens = 32000
+        self._max_messages = 200
+        self._keep_recent_messages = 20
+        # checkpoint thread id -> compaction task, for threads being compacted
+        self._tasks = {}
+        self._initialized = False
+        self._lock = asyncio.Lock()
+
+    async def initialize(self):
+        """Initialize the history compactor, if compaction is enabled"""
+        async with self._lock:
+            if not self._initialized and getValueFromConfig("agent", "compaction_enabled", False):
+                self._model = getModel("memory")
+                self._max_tokens = getValueFromConfig("agent", "compact_after_tokens", self._max_tokens)
+                self._max_messages = getValueFromConfig("agent", "compact_after_messages", self._max_messages)
+                self._keep_recent_messages = getValueFromConfig("agent", "compact_keep_recent_messages", self._keep_recent_messages)
+                self._initialized = True
+                print("History compactor initialized successfully!")
+
+    async def cleanup(self):
+        """Cancel pending compactions; they run again after the thread's next turn"""
+        async with self._lock:
+            if self._initialized:
+                self._initialized = False
+                tasks = list(self._tasks.values())
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                self._tasks.clear()
+                self._model = None
+                print("History compactor cleaned up successfully!")
+
+    def _compaction_start(self, messages: list[AnyMessage]) -> int:
+        """Index of the first turn to keep, or 0 if nothing can be compacted"""
+        # Cut at a human message so no tool call is separated from its result
+        for index in range(len(messages) - self._keep_recent_messages, 0, -1):
+            if isinstance(messages[index], HumanMessage):
+                return index
+        return 0
+
+    def _needs_compaction(self, state: dict) -> bool:
+        messages = state.get("messages") or []
+        if len(messages) > self._max_messages:
+            return True
+        token_counts = state.get("token_counts") or {}
+        tokens = sum(token_counts.get(message.id) or estimate_tokens(message) for message in messages)
+        return tokens > self._max_tokens
+
+    async def _compacted(self, state: dict) -> dict:
+        """State update folding the older turns into the summary, or {} if there is nothing to fold"""
+        if not self._needs_compaction(state):
+            return {}
+        messages = state["messages"]
+        start = self._compaction_start(messages)
+        if start == 0:
+            return {}
+        compacted = messages[:start]
+        conversation_messages = "\n".join(
+            f"{message.type}: {message.content}" for message in compacted
+            if isinstance(message, (HumanMessage, AIMessage, ToolMessage)) and message.content
+        )
+        prompt = [
+            SystemMessage(content="You are a helpful assistant that maintains a running summary of a conversation."),
+            HumanMessage(content=CONVERSATION_SUMMARY_PROMPT.format(
+                summary=state.get("summary") or "(none yet)",
+                conversation_messages=conversation_messages,
+            )),
+        ]
+        summary = (await self._model.ainvoke(prompt)).content
+        print(f"Compacted {len(compacted)} messages into the conversation summary")
+        return {
+            "messages": [RemoveMessage(id=message.id) for message in compacted],
+            "token_counts": {message.id: None for message in compacted},
+            "summary": summary,
+        }
+
+    def schedule(self, user_id: str, thread_id: str, state: dict):
+        """Compact the thread in the background if the finished turn took it over budget"""
+        if not self._initialized or not self._needs_compaction(state):
+            return
+        full_thread_id = f"{user_id}_{thread_id}"
+        if full_thread_id in self._tasks:
+            return
+        task = asyncio.create_task(self._compact(full_thread_id, user_id))
+        self._tasks[full_thread_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(full_thread_id, None))
+
+    async def _compact(self, full_thread_id: str, user_id: str):
+        config = {"configurable": {"thread_id": full_thread_id, "user_id": user_id}}
+        try:
+            # Waits for the current turn to release the thread
+            async with admit_turn(full_thread_id):
+                agent = get_agent()
+                state = await agent.aget_state(config)
+                update = await self._compacted(state.values)
+                if update:
+                    # As the last node of a turn, so the thread stays finished
+                    await agent.aupdate_state(config, update, as_node="update_memory_node")
+                    invalidate_history(full_thread_id)
+        except OverloadedError:
+            print(f"Server busy, compaction of thread {full_thread_id} deferred to its next turn")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error compacting thread {full_thread_id}: {e}")
+
+
+# Module-level singleton instance
+_manager = _HistoryCompactor()
+
+# Public API
+async def initialize_history_compactor():
+    await _manager.initialize()
+
+async def cleanup_history_compactor():
+    await _manager.cleanup()
+
+def schedule_compaction(user_id: str, thread_id: str, state: dict):
+    """Fold older turns of the thread into its summary after the response, once it is over budget"""
+    _manager.schedule(user_id, thread_id, state)
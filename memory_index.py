@@ -0,0 +1,223 @@
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+INDEX_MODES = ("flat", "ivf", "ivfpq", "hnsw")
+
+
+class AnnSettings:
+    """Which approximate index large shards are rebuilt into, and how it is searched"""
+
+    def __init__(
+        self,
+        mode: str = "flat",
+        threshold: int = 10_000,
+        rebuild_ratio: float = 0.2,
+        nprobe: int = 16,
+        pq_m: int = 16,
+        hnsw_m: int = 32,
+        ef_search: int = 64,
+        mmap: bool = False,
+    ):
+        if mode not in INDEX_MODES:
+            raise ValueError(f"Unknown memory index mode '{mode}', expected one of {INDEX_MODES}")
+        self.mode = mode
+        # Shards with fewer memories stay on the exact flat index
+        self.threshold = threshold
+        # Rebuild once this fraction of the base index changed through adds and deletes
+        self.rebuild_ratio = rebuild_ratio
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.mmap = mmap
+
+    def factory_string(self, count: int, dimensions: int) -> str:
+        """FAISS index_factory description of the index for `count` vectors"""
+        nlist = max(1, int(4 * math.sqrt(count)))
+        if self.mode == "ivf":
+            return f"IVF{nlist},Flat"
+        if self.mode == "ivfpq":
+            # PQ needs a number of sub-quantizers that divides the dimensions
+            pq_m = max(m for m in range(1, min(self.pq_m, dimensions) + 1) if dimensions % m == 0)
+            # Each sub-quantizer trains 2^bits centroids, which needs at least as many vectors
+            bits = max(1, min(8, int(math.log2(count))))
+            return f"IVF{nlist},PQ{pq_m}x{bits}"
+        if self.mode == "hnsw":
+            return f"HNSW{self.hnsw_m}"
+        return "Flat"
+
+    def search_parameters(self, selector):
+        if self.mode in ("ivf", "ivfpq"):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if self.mode == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
+
+
+def build_flat_index(text_embeddings, embeddings, metadatas, ids) -> FAISS:
+    # Normalized vectors make the L2 distance a function of cosine similarity
+    return FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids, normalize_L2=True)
+
+
+def _normalized(vectors) -> np.ndarray:
+    array = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(array)
+    return array
+
+
+class MemoryIndex:
+    """Searchable memories of one shard.
+
+    Memories live in a flat delta index until the shard outgrows the ANN threshold.
+    The shard is then rebuilt into an immutable base index (IVF, IVF-PQ or HNSW),
+    optionally memory-mapped from disk. Deleting from the base leaves a tombstone
+    and new memories go to the delta until the next rebuild folds both in.
+    """
+
+    BASE_INDEX_FILE = "ann.index"
+    BASE_IDS_FILE = "ann.ids.json"
+
+    def __init__(self, embeddings, settings: AnnSettings):
+        self._embeddings = embeddings
+        self._settings = settings
+        self.base = None
+        # Base position -> memory id
+        self.base_ids = []
+        # Memory id -> (base position, Document) for live memories of the base
+        self._base_docs = {}
+        # Base positions of deleted memories, excluded from searches
+        self.tombstones = set()
+        self._search_parameters = None
+        self.delta = None
+
+    @property
+    def size(self) -> int:
+        return len(self._base_docs) + (self.delta.index.ntotal if self.delta else 0)
+
+    @property
+    def changes_since_build(self) -> int:
+        """Adds and deletes applied since the base index was built"""
+        return (self.delta.index.ntotal if self.delta else 0) + len(self.tombstones)
+
+    def __contains__(self, memory_id: str) -> bool:
+        return memory_id in self._base_docs or (self.delta is not None and memory_id in self.delta.docstore._dict)
+
+    def documents(self) -> list[Document]:
+        docs = [doc for _, doc in self._base_docs.values()]
+        if self.delta:
+            docs.extend(self.delta.docstore._dict.values())
+        return docs
+
+    def add(self, doc: Document, vector: list[float]):
+        if self.delta:
+            self.delta.add_embeddings([(doc.page_content, vector)], metadatas=[doc.metadata], ids=[doc.id])
+        else:
+            self.delta = build_flat_index([(doc.page_content, vector)], self._embeddings, metadatas=[doc.metadata], ids=[doc.id])
+
+    def delete(self, memory_ids: list[str]):
+        delta_ids = []
+        for memory_id in memory_ids:
+            if memory_id in self._base_docs:
+                position, _ = self._base_docs.pop(memory_id)
+                self.tombstones.add(position)
+                self._search_parameters = None
+            else:
+                delta_ids.append(memory_id)
+        if delta_ids:
+            self.delta.delete(ids=delta_ids)
+
+    def search(self, vector: list[float], k: int) -> list[tuple[Document, float]]:
+        """Return up to k (document, squared L2 distance) pairs, closest first"""
+        results = []
+        if self.delta:
+            results.extend(self.delta.similarity_search_with_score_by_vector(vector, k=k))
+        if self._base_docs:
+            if self._search_parameters is None:
+                selector = None
+                if self.tombstones:
+                    selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.fromiter(self.tombstones, dtype=np.int64)))
+                # Keep the selector referenced for as long as the parameters are in use
+                self._search_parameters = (self._settings.search_parameters(selector), selector)
+            distances, positions = self.base.search(_normalized([vector]), k, params=self._search_parameters[0])
+            for distance, position in zip(distances[0], positions[0]):
+                if position != -1:
+                    results.append((self._base_docs[self.base_ids[position]][1], float(distance)))
+        results.sort(key=lambda result: result[1])
+        return results[:k]
+
+    @classmethod
+    def build(cls, embeddings, settings: AnnSettings, records: list) -> "MemoryIndex":
+        """Build an index over the records, using the ANN base index once there are enough of them"""
+        index = cls(embeddings, settings)
+        if settings.mode == "flat" or len(records) < settings.threshold:
+            for record in records:
+                index.add(Document(id=record.memory_id, page_content=record.text, metadata=record.metadata), record.vector)
+            return index
+
+        vectors = _normalized([record.vector for record in records])
+        base = faiss.index_factory(vectors.shape[1], settings.factory_string(len(records), vectors.shape[1]))
+        if not base.is_trained:
+            base.train(vectors)
+        base.add(vectors)
+        index._set_base(base, [record.memory_id for record in records])
+        for position, record in enumerate(records):
+            index._base_docs[record.memory_id] = (position, Document(id=record.memory_id, page_content=record.text, metadata=record.metadata))
+        return index
+
+    def _set_base(self, base, base_ids: list[str]):
+        self.base = base
+        self.base_ids = base_ids
+        self._base_docs = {}
+        self.tombstones = set()
+        self._search_parameters = None
+
+    def save_base(self, directory: str):
+        """Write the base index to disk and, in mmap mode, reopen it memory-mapped"""
+        if self.base is None:
+            return
+        index_path = os.path.join(directory, self.BASE_INDEX_FILE)
+        ids_path = os.path.join(directory, self.BASE_IDS_FILE)
+        os.makedirs(directory, exist_ok=True)
+        faiss.write_index(self.base, f"{index_path}.tmp")
+        with open(f"{ids_path}.tmp", "w") as f:
+            json.dump({"mode": self._settings.mode, "ids": self.base_ids}, f)
+        os.replace(f"{index_path}.tmp", index_path)
+        os.replace(f"{ids_path}.tmp", ids_path)
+        if self._settings.mmap:
+            self.base = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+    @classmethod
+    def load(cls, embeddings, settings: AnnSettings, directory: str, records: list) -> "MemoryIndex":
+        """Restore the index from a saved base index plus the live records of the memory log"""
+        index_path = os.path.join(directory, cls.BASE_INDEX_FILE)
+        ids_path = os.path.join(directory, cls.BASE_IDS_FILE)
+        if settings.mode == "flat" or not os.path.exists(ids_path):
+            return cls.build(embeddings, settings, records)
+
+        with open(ids_path) as f:
+            saved = json.load(f)
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if settings.mmap else 0
+        base = faiss.read_index(index_path, flags)
+        if saved["mode"] != settings.mode or base.ntotal != len(saved["ids"]):
+            # Stale base from another mode or an interrupted save
+            return cls.build(embeddings, settings, records)
+
+        index = cls(embeddings, settings)
+        index._set_base(base, saved["ids"])
+        live = {record.memory_id: record for record in records}
+        for position, memory_id in enumerate(index.base_ids):
+            record = live.pop(memory_id, None)
+            if record is None:
+                index.tombstones.add(position)
+            else:
+                index._base_docs[memory_id] = (position, Document(id=record.memory_id, page_content=record.text, metadata=record.metadata))
+        # Memories written after the base was built
+        for record in live.values():
+            index.add(Document(id=record.memory_id, page_content=record.text, metadata=record.metadata), record.vector)
+        return index
@@ -0,0 +1,142 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+
+OP_ADD = 1
+OP_DELETE = 2
+
+# Every record is framed as (payload length, crc32 of payload) followed by the payload
+_FRAME = struct.Struct("<II")
+# The payload starts with (op, header length, vector dimensions), then the JSON header and the vector
+_PAYLOAD = struct.Struct("<BII")
+
+
+class MemoryRecord:
+    """A single memory operation as stored in the log"""
+
+    def __init__(self, op: int, memory_id: str, user_id: str, text: str = "", metadata: dict = None, vector: list[float] = None):
+        self.op = op
+        self.memory_id = memory_id
+        self.user_id = user_id
+        self.text = text
+        self.metadata = metadata or {}
+        self.vector = vector or []
+
+    def encode(self) -> bytes:
+        header = json.dumps({
+            "memory_id": self.memory_id,
+            "user_id": self.user_id,
+            "text": self.text,
+            "metadata": self.metadata,
+        }).encode("utf-8")
+        payload = _PAYLOAD.pack(self.op, len(header), len(self.vector)) + header + array("f", self.vector).tobytes()
+        return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+    @classmethod
+    def decode(cls, payload) -> "MemoryRecord":
+        op, header_length, dimensions = _PAYLOAD.unpack_from(payload)
+        offset = _PAYLOAD.size
+        header = json.loads(bytes(payload[offset:offset + header_length]))
+        offset += header_length
+        vector = array("f")
+        vector.frombytes(bytes(payload[offset:offset + dimensions * 4]))
+        return cls(op, header["memory_id"], header["user_id"], header["text"], header["metadata"], vector.tolist())
+
+
+def read_records(path: str) -> tuple[list[MemoryRecord], int]:
+    """Read all intact records of a file through a memory map.
+
+    Returns the records and the length of the intact prefix; a torn or corrupt
+    tail (e.g. from a crash mid-append) ends the read.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return [], 0
+
+    records = []
+    offset = 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        while offset + _FRAME.size <= len(data):
+            length, checksum = _FRAME.unpack_from(data, offset)
+            start = offset + _FRAME.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            records.append(MemoryRecord.decode(payload))
+            offset = start + length
+    return records, offset
+
+
+def replay(records: list[MemoryRecord], live: dict = None) -> dict:
+    """Apply records in order and return the live memories by memory id"""
+    live = {} if live is None else live
+    for record in records:
+        if record.op == OP_ADD:
+            live[record.memory_id] = record
+        elif record.op == OP_DELETE:
+            live.pop(record.memory_id, None)
+    return live
+
+
+class MemoryLog:
+    """Append-only log of memory records with periodically compacted snapshots.
+
+    Writes append to `log.bin`; compaction folds the log into `snapshot.bin` so
+    startup only replays the snapshot plus the records written since.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "snapshot.bin")
+        self.log_path = os.path.join(directory, "log.bin")
+        # Records in the log since the last compaction
+        self.log_records = 0
+
+    def load(self) -> dict:
+        """Replay the snapshot and the log, returning the live memories by memory id"""
+        snapshot_records, _ = read_records(self.snapshot_path)
+        log_records, intact_length = read_records(self.log_path)
+        if os.path.exists(self.log_path) and intact_length < os.path.getsize(self.log_path):
+            print(f"Truncating torn tail of memory log {self.log_path}")
+            with open(self.log_path, "r+b") as f:
+                f.truncate(intact_length)
+        self.log_records = len(log_records)
+        # Replay is idempotent, so a crash between snapshot and log truncation is harmless
+        return replay(log_records, replay(snapshot_records))
+
+    def append(self, records: list[MemoryRecord]):
+        """Durably append records to the log"""
+        if not records:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.log_path, "ab") as f:
+            start = f.tell()
+            try:
+                f.write(b"".join(record.encode() for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            except Exception:
+                # Never leave a partial record in front of later appends
+                f.truncate(start)
+                raise
+        self.log_records += len(records)
+
+    def write_snapshot(self, live: dict):
+        """Atomically replace the snapshot with the given live memories and reset the log"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for record in live.values():
+                f.write(record.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        with open(self.log_path, "wb") as f:
+            os.fsync(f.fileno())
+        self.log_records = 0
+
+    def compact(self):
+        """Fold the log into a new snapshot, dropping deleted and superseded records"""
+        self.write_snapshot(self.load())
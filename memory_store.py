@@ -1,76 +1,522 @@
 import asyncio
+import hashlib
+import shutil
+import threading
+import time
 import uuid
 import os
+from collections import OrderedDict
 from langchain.messages import HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate, format_document
-from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 
+from embedding_cache import get_embeddings
+from memory_index import AnnSettings, MemoryIndex
+from memory_log import OP_ADD, OP_DELETE, MemoryLog, MemoryRecord, replay
 from prompt_templates import MEMORY_CREATE_PROMPT
-from utils import getValueFromConfig
+from utils import getValueFromConfig, run_blocking
+
+def _records_from_faiss(store: FAISS) -> list[MemoryRecord]:
+    """Extract the memories and their stored vectors from a pickled FAISS index"""
+    records = []
+    for position, docstore_id in store.index_to_docstore_id.items():
+        doc = store.docstore.search(docstore_id)
+        if doc.metadata.get("namespace") != "memories":
+            continue
+        vector = store.index.reconstruct(position).tolist()
+        records.append(MemoryRecord(OP_ADD, docstore_id, doc.metadata["user_id"], doc.page_content, doc.metadata, vector))
+    return records
+
+class _ConsolidationPolicy:
+    """Dedup and retention rules applied to every user's memories"""
+
+    def __init__(self, similarity_threshold: float, max_memories: int, ttl_days: float):
+        # Cosine similarity above which a new memory supersedes an existing one
+        self.similarity_threshold = similarity_threshold
+        self.max_memories = max_memories
+        self.ttl_seconds = ttl_days * 24 * 60 * 60 if ttl_days else None
+
+    def is_expired(self, metadata: dict, now: float) -> bool:
+        # Memories written before retention was introduced carry no timestamp and never expire
+        created_at = metadata.get("created_at")
+        return self.ttl_seconds is not None and created_at is not None and now - created_at > self.ttl_seconds
+
+def _cosine_similarity(distance: float) -> float:
+    """Cosine similarity of two unit vectors from their squared L2 distance"""
+    return 1 - distance / 2
+
+class _MemoryShard:
+    """A single user's FAISS index, persisted as an append-only log in its own directory"""
+
+    def __init__(self, user_id: str, path: str, compact_after: int, policy: _ConsolidationPolicy, ann: AnnSettings, embeddings):
+        self.user_id = user_id
+        self.path = path
+        self.index = MemoryIndex(embeddings, ann)
+        self.log = MemoryLog(path)
+        self._compact_after = compact_after
+        self._policy = policy
+        self._ann = ann
+        self._embeddings = embeddings
+        # While a rebuild runs in the background, the writes it has to replay onto the new index
+        self._rebuild_backlog = None
+        # Records already in the index but not yet appended to the log
+        self.pending_records = []
+        # Set when the in-memory index has changes that are not on disk yet
+        self.dirty = False
+        # Writes in progress, which keep the shard from being evicted
+        self.writers = 0
+        # Guards the index against being saved from a worker thread while it is modified
+        self.lock = threading.Lock()
+        # Serializes log appends and compaction
+        self._log_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Number of memories held by this shard"""
+        return self.index.size
+
+    def load(self):
+        """Rebuild the shard's index from its snapshot and log, without re-embedding"""
+        if os.path.exists(os.path.join(self.path, "index.faiss")):
+            self._migrate_pickled_index()
+
+        records = list(self.log.load().values())
+        self.index = MemoryIndex.load(self._embeddings, self._ann, self.path, records)
+        with self.lock:
+            self._enforce_retention()
+
+    def _migrate_pickled_index(self):
+        """Convert a shard saved with FAISS.save_local into a log snapshot"""
+        print(f"Migrating memory shard {self.path} to the memory log format...")
+        store = FAISS.load_local(
+            self.path,
+            self._embeddings,
+            allow_dangerous_deserialization=True  # Required for pickle loading
+        )
+        self.log.write_snapshot({record.memory_id: record for record in _records_from_faiss(store)})
+        for file_name in ("index.faiss", "index.pkl"):
+            os.remove(os.path.join(self.path, file_name))
+
+    def save(self):
+        """Append the pending records to the shard's log, compacting it once it grew too long"""
+        with self._log_lock:
+            with self.lock:
+                records = self.pending_records
+                self.pending_records = []
+                self.dirty = False
+            try:
+                self.log.append(records)
+            except Exception:
+                with self.lock:
+                    self.pending_records = records + self.pending_records
+                    self.dirty = True
+                raise
+            if self.log.log_records >= self._compact_after:
+                self.log.compact()
+
+    def add_embeddings(self, documents: list[Document], vectors: list[list[float]]):
+        """Add already embedded documents to the shard's index.
+
+        A new memory supersedes an existing near-duplicate, and the user's
+        retention budget is enforced afterwards.
+        """
+        with self.lock:
+            for doc, vector in zip(documents, vectors):
+                duplicate_id = self._find_duplicate(vector)
+                if duplicate_id:
+                    doc.metadata["supersedes"] = duplicate_id
+                    self._delete([duplicate_id])
+
+                self.index.add(doc, vector)
+                self._record(MemoryRecord(OP_ADD, doc.id, self.user_id, doc.page_content, doc.metadata, vector))
+            self._enforce_retention()
+
+    def _find_duplicate(self, vector: list[float]):
+        """Return the id of an existing memory that is a near-duplicate of the vector"""
+        if not self.size:
+            return None
+        # IVF searches only probe some lists, which may hold nothing but tombstones
+        results = self.index.search(vector, k=1)
+        if not results:
+            return None
+        doc, distance = results[0]
+        if _cosine_similarity(distance) >= self._policy.similarity_threshold:
+            return doc.id
+        return None
+
+    def _delete(self, memory_ids: list[str]):
+        self.index.delete(memory_ids)
+        for memory_id in memory_ids:
+            self._record(MemoryRecord(OP_DELETE, memory_id, self.user_id))
+
+    def _record(self, record: MemoryRecord):
+        """Queue a write for the log (caller holds the lock)"""
+        self.pending_records.append(record)
+        if self._rebuild_backlog is not None:
+            self._rebuild_backlog.append(record)
+        self.dirty = True
+
+    def _enforce_retention(self):
+        """Evict expired memories, then the oldest ones beyond the per-user cap"""
+        if not self.size:
+            return
+        now = time.time()
+        memories = self.index.documents()
+        expired = [doc.id for doc in memories if self._policy.is_expired(doc.metadata, now)]
+        if expired:
+            self._delete(expired)
+
+        over_cap = self.size - self._policy.max_memories
+        if over_cap > 0:
+            expired_ids = set(expired)
+            live = [doc for doc in memories if doc.id not in expired_ids]
+            live.sort(key=lambda doc: doc.metadata.get("created_at", 0))
+            self._delete([doc.id for doc in live[:over_cap]])
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int) -> list[Document]:
+        with self.lock:
+            now = time.time()
+            return [
+                doc for doc, _ in self.index.search(embedding, k=k)
+                # Expired memories are only swept on the next write, so skip them here
+                if not self._policy.is_expired(doc.metadata, now)
+            ]
+
+    def needs_rebuild(self) -> bool:
+        """Whether the index should be (re)built into the configured ANN index"""
+        if self._ann.mode == "flat" or self._rebuild_backlog is not None or self.size < self._ann.threshold:
+            return False
+        if self.index.base is None:
+            return True
+        return self.index.changes_since_build > self._ann.rebuild_ratio * len(self.index.base_ids)
+
+    def rebuild(self):
+        """Rebuild the index from the shard's records while it keeps serving (blocking)"""
+        with self.lock:
+            # Everything written before this point is either pending or already in the log
+            pending = list(self.pending_records)
+            self._rebuild_backlog = []
+        try:
+            with self._log_lock:
+                live = replay(pending, self.log.load())
+            index = MemoryIndex.build(self._embeddings, self._ann, list(live.values()))
+            index.save_base(self.path)
+
+            with self.lock:
+                # Catch up with the writes that happened during the build
+                for record in self._rebuild_backlog:
+                    if record.op == OP_ADD:
+                        # Writes flushed to the log before it was loaded are already in the new index
+                        if record.memory_id not in index:
+                            index.add(Document(id=record.memory_id, page_content=record.text, metadata=record.metadata), record.vector)
+                    elif record.memory_id in index:
+                        index.delete([record.memory_id])
+                self.index = index
+        finally:
+            with self.lock:
+                self._rebuild_backlog = None
+
+class _WriteBehindPersister:
+    """Flushes dirty memory shards to disk from a background task.
+
+    Writes only mark their shard dirty; the shards are saved once `flush_interval`
+    seconds have passed or `max_pending` writes have accumulated, whichever is first.
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int, on_flushed=None):
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._on_flushed = on_flushed
+        self._dirty_shards = {}
+        self._pending_writes = 0
+        self._flush_requested = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def mark_dirty(self, shard: _MemoryShard):
+        """Queue a shard for the next flush (must be called on the event loop)"""
+        shard.dirty = True
+        self._dirty_shards[shard.user_id] = shard
+        self._pending_writes += 1
+        if self._pending_writes >= self._max_pending:
+            self._flush_requested.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            # stop() does the final flush
+            if self._stopping:
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing memory shards: {e}")
+
+    async def flush(self):
+        """Save every dirty shard without blocking the event loop"""
+        self._flush_requested.clear()
+        self._pending_writes = 0
+        for shard in list(self._dirty_shards.values()):
+            # Dequeued one at a time, so the shards not saved yet stay queued if this one fails
+            self._dirty_shards.pop(shard.user_id, None)
+            try:
+                await run_blocking(shard.save)
+            except BaseException:
+                # Keep the shard queued so the next flush retries it
+                self._dirty_shards.setdefault(shard.user_id, shard)
+                raise
+        if self._on_flushed:
+            self._on_flushed()
+
+    async def stop(self):
+        """Stop the background task and flush whatever is still pending"""
+        if self._task:
+            # Let a flush in progress finish rather than cancelling it mid-save
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+        await self.flush()
 
 class _MemoryStore:
-    """Internal memory store (not exposed directly)"""
-    
+    """Internal memory store (not exposed directly)
+
+    Memories are sharded per user: every user gets their own memory log on disk,
+    which is loaded into a FAISS index on first access and kept in an LRU of
+    resident shards.
+    """
+
     def __init__(self):
-        self._memory_store = None
+        self._embeddings = None
+        # user_id -> _MemoryShard, least recently used first
+        self._shards = OrderedDict()
+        # Shards are loaded and evicted from worker threads as well as the event loop;
+        # only held for bookkeeping, never while a shard loads
+        self._shards_lock = threading.RLock()
+        # user_id -> Event set once the shard being loaded by another thread is ready
+        self._loading = {}
         self._initialized = False
         self._persist_dir = "./faiss_memory"
+        self._max_loaded_shards = 64
+        self._max_resident_vectors = 100_000
+        self._compact_after = 1000
+        self._policy = None
+        self._ann = None
+        # user_id -> background rebuild task
+        self._rebuilds = {}
+        self._persister = None
         self._lock = asyncio.Lock()
-    
+
     async def initialize(self):
         """Initialize the memory store"""
         async with self._lock:
             if not self._initialized:
                 memory_embedding_model = getValueFromConfig("memory", "memory_embedding_model")
-                embeddings = OllamaEmbeddings(model=memory_embedding_model)
-
-                # Create persist directory if it doesn't exist
-                os.makedirs(self._persist_dir, exist_ok=True)
-
-                # Try to load existing FAISS index
-                index_path = os.path.join(self._persist_dir, "index")
-                if os.path.exists(f"{index_path}.faiss"):
-                    print("Loading existing FAISS index...")
-                    self._memory_store = FAISS.load_local(
-                        self._persist_dir,
-                        embeddings,
-                        allow_dangerous_deserialization=True  # Required for pickle loading
+                self._embeddings = get_embeddings(memory_embedding_model)
+                self._max_loaded_shards = getValueFromConfig("memory", "max_loaded_shards", self._max_loaded_shards)
+                self._max_resident_vectors = getValueFromConfig("memory", "max_resident_vectors", self._max_resident_vectors)
+                self._compact_after = getValueFromConfig("memory", "compact_after_records", self._compact_after)
+                self._policy = _ConsolidationPolicy(
+                    similarity_threshold=getValueFromConfig("memory", "dedup_similarity_threshold", 0.92),
+                    max_memories=getValueFromConfig("memory", "max_memories_per_user", 500),
+                    ttl_days=getValueFromConfig("memory", "memory_ttl_days", 0),
+                )
+                self._ann = AnnSettings(
+                    mode=getValueFromConfig("memory", "index_mode", "flat"),
+                    threshold=getValueFromConfig("memory", "ann_threshold", 10_000),
+                    rebuild_ratio=getValueFromConfig("memory", "ann_rebuild_ratio", 0.2),
+                    nprobe=getValueFromConfig("memory", "ivf_nprobe", 16),
+                    pq_m=getValueFromConfig("memory", "pq_m", 16),
+                    hnsw_m=getValueFromConfig("memory", "hnsw_m", 32),
+                    ef_search=getValueFromConfig("memory", "hnsw_ef_search", 64),
+                    mmap=getValueFromConfig("memory", "mmap_index", False),
+                )
+                if self._ann.mode != "flat" and self._ann.threshold > self._policy.max_memories:
+                    print(
+                        f"Warning: memory index_mode '{self._ann.mode}' has no effect, shards are capped at "
+                        f"max_memories_per_user={self._policy.max_memories} below ann_threshold={self._ann.threshold}"
                     )
-                    print("FAISS memory store loaded successfully!")
-                else:
-                    print("Creating new FAISS index...")
-                    # Create a new FAISS index with a dummy document
-                    dummy_doc = Document(
-                        page_content="initialization",
-                        metadata={"user_id": "system", "namespace": "init"}
-                    )
-                    self._memory_store = FAISS.from_documents([dummy_doc], embeddings)
-                    self._save_index()
-                    print("FAISS memory store created successfully!")
+
+                # Create shards directory if it doesn't exist
+                os.makedirs(os.path.join(self._persist_dir, "shards"), exist_ok=True)
+
+                # Split a pre-sharding global index into per-user shards
+                if os.path.exists(os.path.join(self._persist_dir, "index.faiss")):
+                    self._migrate_global_index()
+
+                self._persister = _WriteBehindPersister(
+                    flush_interval=getValueFromConfig("memory", "flush_interval_seconds", 5.0),
+                    max_pending=getValueFromConfig("memory", "flush_max_pending", 20),
+                    # Flushed shards are clean again and may now be evicted
+                    on_flushed=self._evict_shards,
+                )
+                self._persister.start()
 
                 self._initialized = True
                 print("Memory store initialized successfully!")
-    
-    def _save_index(self):
-        """Save FAISS index to disk"""
-        if self._memory_store:
-            self._memory_store.save_local(self._persist_dir)
-    
+
+    def _migrate_global_index(self):
+        """Split the legacy single FAISS index into per-user shards, reusing the stored vectors"""
+        print("Migrating global FAISS index to per-user shards...")
+        legacy_store = FAISS.load_local(
+            self._persist_dir,
+            self._embeddings,
+            allow_dangerous_deserialization=True  # Required for pickle loading
+        )
+
+        memories_by_user = {}
+        for record in _records_from_faiss(legacy_store):
+            memories_by_user.setdefault(record.user_id, {})[record.memory_id] = record
+
+        for user_id, live in memories_by_user.items():
+            MemoryLog(self._shard_path(user_id)).write_snapshot(live)
+
+        legacy_dir = os.path.join(self._persist_dir, "legacy")
+        os.makedirs(legacy_dir, exist_ok=True)
+        for file_name in ("index.faiss", "index.pkl"):
+            legacy_file = os.path.join(self._persist_dir, file_name)
+            if os.path.exists(legacy_file):
+                shutil.move(legacy_file, os.path.join(legacy_dir, file_name))
+        print(f"Migrated memories of {len(memories_by_user)} users to shards!")
+
+    def _shard_path(self, user_id: str) -> str:
+        # Hash the user id so that arbitrary ids map to safe directory names
+        shard_name = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self._persist_dir, "shards", shard_name)
+
+    def get_shard(self, user_id: str, create: bool = False):
+        """Get the shard of a user, loading it from disk on first access.
+
+        Returns None if the user has no memories yet, unless `create` is set.
+        Loading reads the index from disk, so call this from a worker thread.
+        """
+        while True:
+            with self._shards_lock:
+                shard = self._shards.get(user_id)
+                if shard:
+                    self._shards.move_to_end(user_id)
+                    return shard
+
+                loading = self._loading.get(user_id)
+                if loading is None:
+                    path = self._shard_path(user_id)
+                    if not os.path.isdir(path) and not create:
+                        return None
+                    loading = threading.Event()
+                    self._loading[user_id] = loading
+                    break
+            # Another thread is loading this shard; take it from the LRU once it's done
+            loading.wait()
+
+        # Loaded without holding the shards lock, which eviction takes on the event loop
+        try:
+            shard = _MemoryShard(user_id, path, self._compact_after, self._policy, self._ann, self._embeddings)
+            shard.load()
+            with self._shards_lock:
+                self._shards[user_id] = shard
+        finally:
+            with self._shards_lock:
+                del self._loading[user_id]
+            loading.set()
+        self._evict_shards()
+        return shard
+
+    def _evict_shards(self):
+        """Drop least recently used shards until the resident budget is met"""
+        with self._shards_lock:
+            resident_vectors = self.resident_vectors
+            # Never evict the most recently used shard, even if it alone exceeds the budget
+            for user_id in list(self._shards)[:-1]:
+                if len(self._shards) <= self._max_loaded_shards and resident_vectors <= self._max_resident_vectors:
+                    break
+                shard = self._shards[user_id]
+                # Dirty shards stay resident until the persister has flushed them,
+                # and shards being written to until the write is done
+                if shard.dirty or shard.writers:
+                    continue
+                resident_vectors -= shard.size
+                del self._shards[user_id]
+
+    def _add_embeddings(self, user_id: str, documents: list[Document], vectors: list[list[float]]) -> _MemoryShard:
+        while True:
+            shard = self.get_shard(user_id, create=True)
+            with self._shards_lock:
+                # Pinned so it can't be evicted before the write marks it dirty
+                if self._shards.get(user_id) is shard:
+                    shard.writers += 1
+                    break
+            # Evicted right after loading, load it again
+        try:
+            shard.add_embeddings(documents, vectors)
+        finally:
+            with self._shards_lock:
+                shard.writers -= 1
+        return shard
+
+    async def add_documents(self, user_id: str, documents: list[Document]):
+        """Add documents to the user's shard, which is persisted by the write-behind flusher"""
+        vectors = await self._embeddings.aembed_documents([doc.page_content for doc in documents])
+        shard = await run_blocking(self._add_embeddings, user_id, documents, vectors)
+        self._persister.mark_dirty(shard)
+        self._schedule_rebuild(shard)
+
+    async def similarity_search(self, user_id: str, query: str, k: int) -> list[Document]:
+        """Search the user's shard without blocking the event loop"""
+        shard = await run_blocking(self.get_shard, user_id)
+        if not shard:
+            return []
+        if shard.dirty:
+            # Loading swept expired or over-budget memories that still need persisting
+            self._persister.mark_dirty(shard)
+        self._schedule_rebuild(shard)
+        embedding = await self._embeddings.aembed_query(query)
+        return await run_blocking(shard.similarity_search_by_vector, embedding, k)
+
+    def _schedule_rebuild(self, shard: _MemoryShard):
+        """Rebuild the shard's ANN index in the background once it is due"""
+        if shard.user_id in self._rebuilds or not shard.needs_rebuild():
+            return
+
+        async def rebuild():
+            try:
+                await run_blocking(shard.rebuild)
+                print(f"Rebuilt {self._ann.mode} memory index of {shard.size} memories")
+            except Exception as e:
+                print(f"Error rebuilding memory index: {e}")
+            finally:
+                self._rebuilds.pop(shard.user_id, None)
+
+        self._rebuilds[shard.user_id] = asyncio.create_task(rebuild())
+
     async def cleanup(self):
         """Cleanup the memory store"""
         async with self._lock:
             if self._initialized:
-                self._save_index()
-                self._memory_store = None
+                # Rebuilds run in worker threads and can't be cancelled, so let them finish
+                await asyncio.gather(*self._rebuilds.values())
+                # Guaranteed final flush of everything still pending
+                await self._persister.stop()
+                self._persister = None
+                self._shards.clear()
+                self._embeddings = None
                 self._initialized = False
                 print("Memory store cleaned up successfully!")
-    
+
     @property
-    def memory_store(self):
-        """Get the memory store instance"""
-        return self._memory_store
+    def resident_vectors(self) -> int:
+        """Total number of vectors held by the loaded shards"""
+        with self._shards_lock:
+            return sum(shard.size for shard in self._shards.values())
+
+    def is_initialized(self) -> bool:
+        return self._initialized
 
 # Module-level singleton instance
 _manager = _MemoryStore()
@@ -83,32 +529,16 @@ async def cleanup_memory_store():
     await _manager.cleanup()
 
 def get_memory_store():
-    return _manager.memory_store
-
-def _save_memory_store():
-    """Helper to save the FAISS index"""
-    _manager._save_index()
+    return _manager if _manager.is_initialized() else None
 
-def getMemoriesForUserBasedOnQuery(user_id: str, query: str, limit: int = 3):
-    """Search memories using FAISS similarity search"""
+async def getMemoriesForUserBasedOnQuery(user_id: str, query: str, limit: int = 3):
+    """Search the user's memory shard using FAISS similarity search"""
     store = get_memory_store()
     if not store:
         return []
-    
-    # Search with more results to filter by user
-    results = store.similarity_search_with_score(
-        query=query,
-        k=limit * 10,  # Fetch more to filter by user_id
-        filter={"user_id": user_id, "namespace": "memories"}
-    )
-    
-    # Filter and limit results
-    filtered_results = [
-        doc.page_content for doc, score in results
-        if doc.metadata.get("user_id") == user_id and doc.metadata.get("namespace") == "memories"
-    ][:limit]
-    
-    return filtered_results
+
+    documents = await store.similarity_search(user_id, query, k=limit)
+    return [doc.page_content for doc in documents]
 
 async def updateMemoryForUser(user_id: str, messages, memory_creator):
     # Namespace the memory
@@ -120,9 +550,9 @@ async def updateMemoryForUser(user_id: str, messages, memory_creator):
     # Creating the memory create prompt
     memory_create_prompt_template = PromptTemplate.from_template(MEMORY_CREATE_PROMPT)
     conversation_messages = "\n".join(["user: " + msg.content if isinstance(msg, HumanMessage) else "assistant: " + msg.content for msg in messages])
-    
+
     memory_create_prompt = memory_create_prompt_template.invoke({"conversation_messages": conversation_messages})
-    
+
     memory_prompt_template = ChatPromptTemplate.from_messages([
         ("system", "You are a helpful assistant designed to create concise summaries (short-term memories) of conversations."),
         ("human", "{input}")
@@ -133,14 +563,14 @@ async def updateMemoryForUser(user_id: str, messages, memory_creator):
 
     doc = Document(
         page_content=stringified_memory,
+        id=memory_id,
         metadata={
             "user_id": user_id,
             "namespace": "memories",
-            "memory_id": memory_id
+            "memory_id": memory_id,
+            "created_at": time.time()
         }
     )
-    get_memory_store().add_documents([doc])
-    
-    # Save to disk after adding
-    _save_memory_store()
-    print(f"Memory saved and persisted to disk: \n\n {stringified_memory} \n\n")
\ No newline at end of file
+    # The shard is persisted to disk in the background
+    await get_memory_store().add_documents(user_id, [doc])
+    print(f"Memory saved: \n\n {stringified_memory} \n\n")
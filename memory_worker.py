@@ -0,0 +1,120 @@
+import asyncio
+
+from memory_store import updateMemoryForUser
+from utils import getValueFromConfig
+
+
+class _PendingMemory:
+    """Turns of one thread waiting to be summarized into a memory"""
+
+    def __init__(self, user_id: str, memory_creator):
+        self.user_id = user_id
+        self.memory_creator = memory_creator
+        self.messages = []
+        self.turns = 0
+
+
+class _MemoryWorker:
+    """Internal memory creation worker (not exposed directly)
+
+    Finished turns are queued per thread and summarized into memories by background
+    workers, so the chat response doesn't wait for the summarization call. Turns of
+    the same thread that are still pending are merged into a single summarization.
+    """
+
+    def __init__(self):
+        # thread_id -> _PendingMemory, for threads waiting in the queue
+        self._pending = {}
+        self._queue = None
+        # Threads waiting for or undergoing summarization
+        self._queued_threads = 0
+        self._workers = []
+        self._num_workers = 2
+        self._max_pending_threads = 100
+        self._drain_timeout = 30.0
+        self._initialized = False
+        self._lock = asyncio.Lock()
+
+    async def initialize(self):
+        """Start the memory creation workers"""
+        async with self._lock:
+            if not self._initialized:
+                self._num_workers = getValueFromConfig("memory_worker", "workers", self._num_workers)
+                self._max_pending_threads = getValueFromConfig("memory_worker", "max_pending_threads", self._max_pending_threads)
+                self._drain_timeout = getValueFromConfig("memory_worker", "drain_timeout_seconds", self._drain_timeout)
+
+                self._queue = asyncio.Queue()
+                self._workers = [asyncio.create_task(self._run()) for _ in range(self._num_workers)]
+                self._initialized = True
+                print("Memory worker initialized successfully!")
+
+    async def cleanup(self):
+        """Drain the queue and stop the workers"""
+        async with self._lock:
+            if self._initialized:
+                # Stop accepting new turns; enqueue falls back to inline creation
+                self._initialized = False
+                print("Draining memory creation queue...")
+                try:
+                    await asyncio.wait_for(self._queue.join(), timeout=self._drain_timeout)
+                except asyncio.TimeoutError:
+                    print(f"Memory creation queue not drained in time, dropping {len(self._pending)} threads")
+                for worker in self._workers:
+                    worker.cancel()
+                await asyncio.gather(*self._workers, return_exceptions=True)
+                self._workers = []
+                self._pending.clear()
+                self._queued_threads = 0
+                self._queue = None
+                print("Memory worker cleaned up successfully!")
+
+    async def enqueue(self, thread_id: str, user_id: str, messages, memory_creator):
+        """Queue a finished turn for memory creation.
+
+        A turn of a thread that is already queued is merged into its pending entry.
+        When `max_pending_threads` threads are already queued the turn is dropped
+        rather than summarized on the request path.
+        """
+        if not self._initialized:
+            await updateMemoryForUser(user_id, messages, memory_creator)
+            return
+
+        pending = self._pending.get(thread_id)
+        if pending is None:
+            if self._queued_threads >= self._max_pending_threads:
+                print(f"Memory creation queue is full, dropping a turn of thread {thread_id}")
+                return
+            pending = _PendingMemory(user_id, memory_creator)
+            self._pending[thread_id] = pending
+            self._queued_threads += 1
+            self._queue.put_nowait(thread_id)
+        pending.messages.extend(messages)
+        pending.turns += 1
+
+    async def _run(self):
+        while True:
+            thread_id = await self._queue.get()
+            # Later turns of this thread start a new pending entry from here on
+            pending = self._pending.pop(thread_id)
+            try:
+                await updateMemoryForUser(pending.user_id, pending.messages, pending.memory_creator)
+            except Exception as e:
+                print(f"Error creating memory for thread {thread_id}: {e}")
+            finally:
+                self._queued_threads -= 1
+                self._queue.task_done()
+
+
+# Module-level singleton instance
+_manager = _MemoryWorker()
+
+# Public API
+async def initialize_memory_worker():
+    await _manager.initialize()
+
+async def cleanup_memory_worker():
+    await _manager.cleanup()
+
+async def enqueue_memory_update(thread_id: str, user_id: str, messages, memory_creator):
+    """Queue a finished turn of a thread for background memory creation"""
+    await _manager.enqueue(thread_id, user_id, messages, memory_creator)
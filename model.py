@@ -1,8 +1,73 @@
+import asyncio
+
 from langchain_ollama import ChatOllama
+from pydantic import PrivateAttr
+
+from utils import getSectionFromConfig
+
+# What each task uses its model for:
+#   chat            - the user-facing answer, latency sensitive
+#   memory          - background summarization of memories and long threads
+#   token_counting  - the tokenizer behind the "model" token counter
+MODEL_TASKS = ("chat", "memory", "token_counting")
+
+_DEFAULT_POOL = {"default": {"model": "llama3.1"}}
+
+
+class _PooledChatOllama(ChatOllama):
+    """ChatOllama that caps its concurrent async generations"""
+
+    max_concurrency: int | None = None
+    _semaphore: asyncio.Semaphore | None = PrivateAttr(default=None)
 
-def getModel():
-    llm = ChatOllama(
-        model="llama3.1",
-        temperature=0,
+    def _limit(self) -> asyncio.Semaphore | None:
+        if self.max_concurrency and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _agenerate(self, *args, **kwargs):
+        semaphore = self._limit()
+        if semaphore is None:
+            return await super()._agenerate(*args, **kwargs)
+        async with semaphore:
+            return await super()._agenerate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        semaphore = self._limit()
+        if semaphore is None:
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+            return
+        async with semaphore:
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+
+
+# Pool entry name -> model instance, shared by every task routed to it
+_models = {}
+
+def _create_model(name: str, settings: dict) -> ChatOllama:
+    if "model" not in settings:
+        raise ValueError(f"Model pool entry '{name}' has no 'model'")
+    return _PooledChatOllama(
+        model=settings["model"],
+        temperature=settings.get("temperature", 0),
+        keep_alive=settings.get("keep_alive"),
+        num_ctx=settings.get("num_ctx"),
+        max_concurrency=settings.get("max_concurrency"),
     )
-    return llm
\ No newline at end of file
+
+def getModel(task: str = "chat"):
+    """Get the model configured for the task in the [models] pool and [model_routing]"""
+    if task not in MODEL_TASKS:
+        raise ValueError(f"Unknown model task '{task}', expected one of {MODEL_TASKS}")
+    pool = getSectionFromConfig("models") or _DEFAULT_POOL
+    routing = getSectionFromConfig("model_routing", {})
+    # Unrouted tasks share the chat model, which defaults to the first pool entry
+    name = routing.get(task) or routing.get("chat") or next(iter(pool))
+    if name not in pool:
+        raise ValueError(f"Model task '{task}' is routed to unknown pool entry '{name}'")
+
+    if name not in _models:
+        _models[name] = _create_model(name, pool[name])
+    return _models[name]
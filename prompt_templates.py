@@ -7,4 +7,17 @@ Output only the memory, with no additional or extraneous text.
 
 Here is the conversation:
 {conversation_messages}
-"""
\ No newline at end of file
+"""
+
+CONVERSATION_SUMMARY_PROMPT = """
+Please update the running summary of a conversation with the messages that follow it.
+Keep every fact, decision, open question and user detail that later turns may rely on,
+and drop small talk. Keep the summary under 300 words.
+Output only the updated summary, with no additional or extraneous text.
+
+Current summary:
+{summary}
+
+New messages:
+{conversation_messages}
+"""
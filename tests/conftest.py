@@ -0,0 +1,10 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def config_file(tmp_path, monkeypatch):
+    """Run every test in its own directory with an empty config.toml, which tests may extend"""
+    monkeypatch.chdir(tmp_path)
+    config = tmp_path / "config.toml"
+    config.write_text("")
+    return config
@@ -0,0 +1,74 @@
+import asyncio
+import gc
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+import admission_controller
+import api
+from dto import ChatRequest
+
+
+@pytest.fixture
+def controller(config_file):
+    config_file.write_text("[admission]\nmax_in_flight = 1\nmax_queued = 4\nqueue_timeout_seconds = 0.2\n")
+    asyncio.run(admission_controller.initialize_admission_controller())
+    yield admission_controller._manager
+    asyncio.run(admission_controller.cleanup_admission_controller())
+
+
+def _request() -> ChatRequest:
+    return ChatRequest(messages=[{"role": "user", "content": "hi"}], thread_id="thread", user_id="user")
+
+
+def _assert_idle(controller):
+    assert controller._in_flight == 0
+    assert controller._queued == 0
+    assert controller._thread_locks == {}
+
+
+def test_streamed_turn_is_released_when_response_is_dropped(controller):
+    async def run():
+        response = await api.universal_agent_chat_stream(_request())
+        assert controller._in_flight == 1
+        # Dropped without being sent or iterated
+        del response
+        gc.collect()
+        _assert_idle(controller)
+
+        # The thread accepts its next turn
+        response = await api.universal_agent_chat_stream(_request())
+        del response
+        gc.collect()
+
+    asyncio.run(run())
+    _assert_idle(controller)
+
+
+def test_streamed_turn_is_released_when_client_disconnects_before_the_body(controller):
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("connection reset")
+
+    async def run():
+        response = await api.universal_agent_chat_stream(_request())
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        with pytest.raises(ClientDisconnect):
+            await response(scope, receive, send)
+        _assert_idle(controller)
+
+    asyncio.run(run())
+
+
+def test_turns_of_a_busy_thread_are_rejected_after_the_queue_timeout(controller):
+    async def run():
+        async with admission_controller.admit_turn("user_thread"):
+            with pytest.raises(admission_controller.OverloadedError) as overloaded:
+                async with admission_controller.admit_turn("user_thread"):
+                    pass
+            assert overloaded.value.retry_after >= 1
+        _assert_idle(controller)
+
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+import asyncio
+import sqlite3
+import uuid
+
+from checkpoint_retention import CheckpointRetention, RetentionPolicy, convert_to_incremental_vacuum
+
+
+def _create_db(path: str, threads: int = 20, checkpoints_per_thread: int = 10):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE checkpoints (thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, checkpoint BLOB)")
+    db.execute("CREATE TABLE writes (thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, value BLOB)")
+    for thread in range(threads):
+        for _ in range(checkpoints_per_thread):
+            db.execute(
+                "INSERT INTO checkpoints VALUES (?, '', ?, ?)",
+                (f"user_{thread}", str(uuid.uuid1()), b"x" * 8192),
+            )
+    db.commit()
+    db.close()
+
+
+def _pragma(path: str, name: str) -> int:
+    db = sqlite3.connect(path)
+    try:
+        return db.execute(f"PRAGMA {name}").fetchone()[0]
+    finally:
+        db.close()
+
+
+def _retention(path: str, **policy) -> CheckpointRetention:
+    return CheckpointRetention(path, checkpointer=None, policy=RetentionPolicy(keep_latest=1, **policy))
+
+
+def test_retention_does_not_full_vacuum_a_live_database(tmp_path):
+    path = str(tmp_path / "checkpoints.db")
+    _create_db(path)
+
+    report = asyncio.run(_retention(path).run_once())
+
+    assert report["checkpoints_deleted"] == 20 * 9
+    # Still the default mode: the conversion is left to the maintenance step
+    assert _pragma(path, "auto_vacuum") == 0
+    assert _pragma(path, "freelist_count") > 0
+
+
+def test_incremental_vacuum_frees_pages_in_steps(tmp_path):
+    path = str(tmp_path / "checkpoints.db")
+    _create_db(path)
+    convert_to_incremental_vacuum(path)
+    assert _pragma(path, "auto_vacuum") == 2
+
+    report = asyncio.run(_retention(path, vacuum_step_pages=50).run_once())
+
+    assert report["bytes_reclaimed"] > 0
+    assert _pragma(path, "freelist_count") == 0
+
+
+def test_first_run_waits_for_the_initial_delay(tmp_path):
+    retention = _retention(str(tmp_path / "checkpoints.db"), initial_delay_seconds=60)
+    runs = []
+
+    async def run_once():
+        runs.append(1)
+
+    retention.run_once = run_once
+
+    async def run():
+        retention.start()
+        await asyncio.sleep(0.1)
+        await retention.stop()
+
+    asyncio.run(run())
+    assert runs == []
@@ -0,0 +1,26 @@
+import asyncio
+
+from conversation_index import _ConversationIndex
+
+
+def test_forgetting_threads_deletes_by_index():
+    async def run():
+        index = _ConversationIndex()
+        await index.initialize()
+        try:
+            for user_id, thread_id in [("user", "a"), ("user", "b"), ("user_a", "b")]:
+                await index.record_turn(user_id, thread_id, 2, None)
+
+            async with index._db.execute(
+                "EXPLAIN QUERY PLAN DELETE FROM conversations WHERE user_id || '_' || thread_id = ?", ("user_a",)
+            ) as cursor:
+                plan = " ".join(row[-1] for row in await cursor.fetchall())
+            assert "USING INDEX conversations_by_checkpoint_thread" in plan
+
+            await index.forget_threads(["user_a", "user_a_b"])
+            async with index._db.execute("SELECT user_id, thread_id FROM conversations") as cursor:
+                assert await cursor.fetchall() == [("user", "b")]
+        finally:
+            await index.cleanup()
+
+    asyncio.run(run())
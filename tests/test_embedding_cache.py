@@ -0,0 +1,76 @@
+import asyncio
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from embedding_cache import _EmbeddingCache
+
+
+class _SlowEmbedding(DeterministicFakeEmbedding):
+    calls: int = 0
+    fail: bool = False
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        if self.fail:
+            raise ConnectionError("embedding server unavailable")
+        return self.embed_documents(texts)
+
+
+def _cache(embeddings) -> _EmbeddingCache:
+    cache = _EmbeddingCache()
+    cache._clients["model"] = embeddings
+    return cache
+
+
+def test_cancelling_the_owner_does_not_cancel_requests_sharing_its_embedding():
+    embeddings = _SlowEmbedding(size=8)
+    cache = _cache(embeddings)
+
+    async def run():
+        owner = asyncio.create_task(cache.aembed("model", ["same text"]))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.aembed("model", ["same text"]))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        return await waiter
+
+    assert asyncio.run(run()) == [embeddings.embed_query("same text")]
+    assert embeddings.calls == 1
+    assert cache._inflight == {}
+
+
+def test_waiters_get_the_owner_error_and_can_retry():
+    embeddings = _SlowEmbedding(size=8, fail=True)
+    cache = _cache(embeddings)
+
+    async def run():
+        owner = asyncio.create_task(cache.aembed("model", ["same text"]))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.aembed("model", ["same text"]))
+        results = await asyncio.gather(owner, waiter, return_exceptions=True)
+        assert all(isinstance(result, ConnectionError) for result in results)
+
+        embeddings.fail = False
+        return await cache.aembed("model", ["same text"])
+
+    assert asyncio.run(run()) == [embeddings.embed_query("same text")]
+
+
+def test_only_document_embeddings_are_persisted_up_to_the_cap():
+    embeddings = _SlowEmbedding(size=8)
+    cache = _cache(embeddings)
+    cache._max_disk_entries = 3
+    cache._db = cache._open_db()
+    cached = cache.get_embeddings("model")
+
+    async def run():
+        await cached.aembed_query("a question")
+        for i in range(5):
+            await cached.aembed_documents([f"memory {i}"])
+
+    asyncio.run(run())
+    cached.embed_query("another question")
+
+    stored = {key for (key,) in cache._db.execute("SELECT text_hash FROM embeddings")}
+    assert stored == {cache._key("model", f"memory {i}")[1] for i in (2, 3, 4)}
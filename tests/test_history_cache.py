@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+import conversation_service
+from history_cache import _HistoryCache, get_cached_history, get_history_version, put_cached_history
+
+
+def _cache(max_threads: int) -> _HistoryCache:
+    cache = _HistoryCache()
+    cache._max_entries = max_threads
+    return cache
+
+
+def test_history_loaded_before_a_write_is_not_cached():
+    cache = _cache(4)
+    version = cache.version("thread")
+    cache.invalidate("thread")
+    cache.put("thread", version, "stale")
+    assert cache.get("thread") is None
+
+    cache.put("thread", cache.version("thread"), "fresh")
+    assert cache.get("thread") == "fresh"
+
+
+def test_versions_are_bounded_and_forgetting_one_keeps_stale_loads_out():
+    cache = _cache(2)
+    version = cache.version("thread")
+    cache.invalidate("thread")
+    for i in range(10):
+        cache.invalidate(f"other {i}")
+    assert len(cache._versions) == 2
+
+    cache.put("thread", version, "stale")
+    assert cache.get("thread") is None
+
+
+def test_versions_are_forgotten_with_evicted_histories():
+    cache = _cache(2)
+    for i in range(5):
+        thread_id = f"thread {i}"
+        cache.invalidate(thread_id)
+        cache.put(thread_id, cache.version(thread_id), i)
+    assert list(cache._entries) == ["thread 3", "thread 4"]
+    assert set(cache._versions) <= {"thread 3", "thread 4"}
+
+
+class _AbortedAgent:
+    def astream(self, *args, **kwargs):
+        async def stream():
+            # A node checkpointed part of the turn, then the run failed
+            put_cached_history("user_thread", get_history_version("user_thread"), "partial")
+            yield {"llm_call": {"messages": []}}
+            raise RuntimeError("model unavailable")
+        return stream()
+
+
+def test_aborted_stream_invalidates_the_thread_history(monkeypatch):
+    monkeypatch.setattr(conversation_service, "get_agent", lambda: _AbortedAgent())
+
+    async def run():
+        async for _ in conversation_service.chat_with_agent_stream_generator("thread", [], "user"):
+            pass
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+    assert get_cached_history("user_thread") is None
@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+
+from langchain.messages import AIMessage, HumanMessage, RemoveMessage
+
+import history_compactor
+
+
+class _SummaryModel:
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return AIMessage("summary")
+
+
+class _Agent:
+    def __init__(self, values: dict):
+        self.values = values
+        self.updates = []
+
+    async def aget_state(self, config):
+        return SimpleNamespace(values=self.values)
+
+    async def aupdate_state(self, config, update, as_node=None):
+        self.updates.append((update, as_node))
+
+
+def _thread(turns: int) -> dict:
+    messages = []
+    for i in range(turns):
+        messages += [HumanMessage(f"question {i}", id=f"h{i}"), AIMessage(f"answer {i}", id=f"a{i}")]
+    return {"messages": messages, "token_counts": {}}
+
+
+def _compactor(monkeypatch, agent: _Agent) -> history_compactor._HistoryCompactor:
+    compactor = history_compactor._HistoryCompactor()
+    compactor._model = _SummaryModel()
+    compactor._max_messages = 6
+    compactor._keep_recent_messages = 2
+    compactor._initialized = True
+    monkeypatch.setattr(history_compactor, "get_agent", lambda: agent)
+    return compactor
+
+
+def test_compaction_runs_after_the_turn_in_the_background(monkeypatch):
+    state = _thread(5)
+    agent = _Agent(state)
+    compactor = _compactor(monkeypatch, agent)
+
+    async def run():
+        compactor.schedule("user", "thread", state)
+        # Scheduling doesn't wait for the summarization call
+        assert compactor._model.calls == 0
+        await asyncio.gather(*compactor._tasks.values())
+
+    asyncio.run(run())
+    [(update, as_node)] = agent.updates
+    assert as_node == "update_memory_node"
+    assert update["summary"] == "summary"
+    assert [message.id for message in update["messages"]] == ["h0", "a0", "h1", "a1", "h2", "a2", "h3", "a3"]
+    assert all(isinstance(message, RemoveMessage) for message in update["messages"])
+
+
+def test_threads_within_budget_are_not_compacted(monkeypatch):
+    state = _thread(2)
+    agent = _Agent(state)
+    compactor = _compactor(monkeypatch, agent)
+
+    async def run():
+        compactor.schedule("user", "thread", state)
+        assert compactor._tasks == {}
+
+    asyncio.run(run())
+    assert agent.updates == []
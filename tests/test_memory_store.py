@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from memory_index import AnnSettings
+import memory_store
+from memory_store import _ConsolidationPolicy, _MemoryShard, _MemoryStore
+
+
+def _shard(tmp_path, ann: AnnSettings) -> _MemoryShard:
+    policy = _ConsolidationPolicy(similarity_threshold=0.99, max_memories=10_000, ttl_days=0)
+    return _MemoryShard("user", str(tmp_path), 1000, policy, ann, DeterministicFakeEmbedding(size=16))
+
+
+def _add(shard: _MemoryShard, embeddings, texts: list[str]) -> list[Document]:
+    documents = [Document(id=str(uuid.uuid4()), page_content=text, metadata={"user_id": "user"}) for text in texts]
+    shard.add_embeddings(documents, embeddings.embed_documents(texts))
+    return documents
+
+
+def test_add_when_probed_ivf_lists_hold_only_tombstones(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    shard = _shard(tmp_path, AnnSettings(mode="ivf", threshold=100, nprobe=1))
+    documents = _add(shard, embeddings, [f"memory {i}" for i in range(400)])
+    shard.rebuild()
+    assert shard.index.base is not None
+
+    with shard.lock:
+        shard._delete([doc.id for doc in documents[1:]])
+
+    # Find a new memory whose probed list only holds deleted vectors
+    text = next(
+        f"new memory {i}" for i in range(1000)
+        if not shard.index.search(embeddings.embed_query(f"new memory {i}"), k=1)
+    )
+    _add(shard, embeddings, [text])
+
+    assert shard.size == 2
+    assert text in {doc.page_content for doc in shard.index.documents()}
+
+
+def test_rebuild_does_not_replay_writes_already_in_the_log(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    shard = _shard(tmp_path, AnnSettings(mode="ivf", threshold=100))
+    _add(shard, embeddings, [f"memory {i}" for i in range(200)])
+    shard.save()
+
+    load = shard.log.load
+
+    def load_after_concurrent_write():
+        # A write lands and is flushed between the backlog snapshot and the log load
+        _add(shard, embeddings, ["concurrent memory"])
+        with shard.lock:
+            records, shard.pending_records = shard.pending_records, []
+        shard.log.append(records)
+        return load()
+
+    shard.log.load = load_after_concurrent_write
+    shard.rebuild()
+
+    assert shard.size == 201
+    assert [doc.page_content for doc in shard.index.documents()].count("concurrent memory") == 1
+
+
+def _store(tmp_path) -> _MemoryStore:
+    store = _MemoryStore()
+    store._persist_dir = str(tmp_path)
+    store._embeddings = DeterministicFakeEmbedding(size=16)
+    store._policy = _ConsolidationPolicy(similarity_threshold=0.99, max_memories=10_000, ttl_days=0)
+    store._ann = AnnSettings()
+    return store
+
+
+def test_shard_load_does_not_block_eviction_and_happens_once(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    loads = []
+    load = _MemoryShard.load
+
+    def slow_load(shard):
+        loads.append(shard.user_id)
+        time.sleep(0.3)
+        load(shard)
+
+    monkeypatch.setattr(memory_store._MemoryShard, "load", slow_load)
+    shards = []
+    loaders = [threading.Thread(target=lambda: shards.append(store.get_shard("user", create=True))) for _ in range(2)]
+    for loader in loaders:
+        loader.start()
+    time.sleep(0.05)
+
+    # What the persister's flush callback does on the event loop
+    started = time.monotonic()
+    store._evict_shards()
+    assert time.monotonic() - started < 0.1
+
+    for loader in loaders:
+        loader.join()
+    assert loads == ["user"]
+    assert shards[0] is shards[1]
+
+
+class _FakeShard:
+    def __init__(self, user_id: str, save_delay: float = 0.0, failures: int = 0):
+        self.user_id = user_id
+        self.dirty = False
+        self.saves = 0
+        self._save_delay = save_delay
+        self._failures = failures
+
+    def save(self):
+        time.sleep(self._save_delay)
+        if self._failures:
+            self._failures -= 1
+            raise OSError("disk full")
+        self.saves += 1
+        self.dirty = False
+
+
+def test_failed_flush_keeps_the_shards_not_saved_yet_queued():
+    async def run():
+        persister = memory_store._WriteBehindPersister(flush_interval=60, max_pending=100)
+        shards = [_FakeShard("first", failures=1), _FakeShard("second")]
+        for shard in shards:
+            persister.mark_dirty(shard)
+        with pytest.raises(OSError):
+            await persister.flush()
+
+        await persister.stop()
+        assert [shard.saves for shard in shards] == [1, 1]
+        assert not any(shard.dirty for shard in shards)
+
+    asyncio.run(run())
+
+
+def test_stop_lets_a_flush_in_progress_finish():
+    async def run():
+        persister = memory_store._WriteBehindPersister(flush_interval=60, max_pending=2)
+        persister.start()
+        shards = [_FakeShard("first", save_delay=0.2), _FakeShard("second")]
+        for shard in shards:
+            persister.mark_dirty(shard)
+        # Stop while the background flush is saving the first shard
+        await asyncio.sleep(0.05)
+        await persister.stop()
+
+        assert [shard.saves for shard in shards] == [1, 1]
+        assert not any(shard.dirty for shard in shards)
+
+    asyncio.run(run())
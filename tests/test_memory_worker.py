@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+import memory_worker
+
+
+def _worker(monkeypatch, config_file, created: list) -> memory_worker._MemoryWorker:
+    config_file.write_text("[memory_worker]\nworkers = 1\nmax_pending_threads = 1\n")
+
+    async def update_memory(user_id, messages, memory_creator):
+        created.append(list(messages))
+        await asyncio.sleep(0.2)
+
+    monkeypatch.setattr(memory_worker, "updateMemoryForUser", update_memory)
+    return memory_worker._MemoryWorker()
+
+
+def test_turns_of_a_queued_thread_are_merged_without_taking_capacity(monkeypatch, config_file):
+    created = []
+    worker = _worker(monkeypatch, config_file, created)
+
+    async def run():
+        await worker.initialize()
+        for turn in ("first", "second", "third"):
+            await worker.enqueue("thread", "user", [turn], None)
+        await worker.cleanup()
+
+    asyncio.run(run())
+    assert created == [["first", "second", "third"]]
+
+
+def test_turns_are_dropped_instead_of_summarized_inline_when_full(monkeypatch, config_file):
+    created = []
+    worker = _worker(monkeypatch, config_file, created)
+
+    async def run():
+        await worker.initialize()
+        await worker.enqueue("thread", "user", ["queued"], None)
+        started = time.monotonic()
+        await worker.enqueue("other thread", "user", ["dropped"], None)
+        assert time.monotonic() - started < 0.1
+        await worker.cleanup()
+
+    asyncio.run(run())
+    assert created == [["queued"]]
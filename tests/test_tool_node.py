@@ -0,0 +1,40 @@
+import asyncio
+import threading
+import time
+
+from langchain.messages import AIMessage
+from langchain_core.tools import tool
+
+import agent
+import utils
+
+
+def test_hung_sync_tools_do_not_starve_the_blocking_pool(config_file, monkeypatch):
+    config_file.write_text("[runtime]\nblocking_pool_size = 2\n\n[tools]\ncall_timeout_seconds = 0.1\n")
+    monkeypatch.setattr(utils, "_blocking_executor", None)
+    hang = threading.Event()
+
+    @tool
+    def stuck_search(query: str) -> str:
+        """Search that never returns"""
+        hang.wait()
+        return query
+
+    tool_node = agent.getToolNode([stuck_search])
+    calls = [{"name": "stuck_search", "args": {"query": "q"}, "id": f"call {i}"} for i in range(2)]
+    state = {"messages": [AIMessage("", tool_calls=calls)]}
+    config = {"configurable": {"user_id": "user"}}
+
+    async def run():
+        result = await tool_node(state, config)
+        assert [message.status for message in result["messages"]] == ["error", "error"]
+
+        # The timed out tools still hold their threads, memory retrieval must not wait for them
+        started = time.monotonic()
+        assert await asyncio.wait_for(utils.run_blocking(lambda: "memories"), timeout=1) == "memories"
+        assert time.monotonic() - started < 0.5
+
+    try:
+        asyncio.run(run())
+    finally:
+        hang.set()
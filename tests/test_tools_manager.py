@@ -0,0 +1,57 @@
+import asyncio
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.tools import tool
+
+from tools_manager import _ToolsManager, _tool_id
+
+
+@tool
+def add_numbers(a: int, b: int) -> int:
+    """Add two numbers"""
+    return a + b
+
+
+@tool
+def multiply(a: int, b: int) -> int:
+    """Multiply two numbers"""
+    return a * b
+
+
+def _manager(tmp_path) -> _ToolsManager:
+    manager = _ToolsManager()
+    manager._index_path = str(tmp_path / "tool_index.json")
+    manager._tool_registry = {_tool_id(t): t for t in (add_numbers, multiply)}
+    return manager
+
+
+def _vector_sizes(vector_store) -> set[int]:
+    return {len(entry["vector"]) for entry in vector_store.store.values()}
+
+
+def test_tool_index_is_reused_for_the_same_embedding_model(tmp_path):
+    asyncio.run(_manager(tmp_path)._load_index(DeterministicFakeEmbedding(size=8), "model-a"))
+
+    class CountingEmbedding(DeterministicFakeEmbedding):
+        calls: int = 0
+
+        def embed_documents(self, texts):
+            self.calls += len(texts)
+            return super().embed_documents(texts)
+
+    embeddings = CountingEmbedding(size=8)
+    vector_store = asyncio.run(_manager(tmp_path)._load_index(embeddings, "model-a"))
+    assert embeddings.calls == 0
+    assert len(vector_store.store) == 2
+
+
+def test_tool_index_is_rebuilt_when_the_embedding_model_changes(tmp_path):
+    asyncio.run(_manager(tmp_path)._load_index(DeterministicFakeEmbedding(size=8), "model-a"))
+
+    vector_store = asyncio.run(_manager(tmp_path)._load_index(DeterministicFakeEmbedding(size=16), "model-b"))
+    assert _vector_sizes(vector_store) == {16}
+
+    # The rebuilt index is persisted for the new model
+    vector_store = asyncio.run(_manager(tmp_path)._load_index(DeterministicFakeEmbedding(size=16), "model-b"))
+    assert _vector_sizes(vector_store) == {16}
+    assert {entry["metadata"]["embeddings_model"] for entry in vector_store.store.values()} == {"model-b"}
@@ -0,0 +1,67 @@
+import json
+import math
+
+from langchain_core.messages import AnyMessage, ToolMessage
+
+# Role markers and separators the chat template adds around every message
+_MESSAGE_OVERHEAD_TOKENS = 4
+_CHARS_PER_TOKEN = 4
+
+TOKEN_COUNTER_MODES = ("estimate", "model")
+
+
+def merge_token_counts(left: dict | None, right: dict | None) -> dict:
+    """State reducer for token counts by message id; a None count drops the entry"""
+    merged = dict(left or {})
+    for message_id, tokens in (right or {}).items():
+        if tokens is None:
+            merged.pop(message_id, None)
+        else:
+            merged[message_id] = tokens
+    return merged
+
+
+def estimate_tokens(message: AnyMessage) -> int:
+    """Fast local estimate of a message's tokens from its length"""
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    chars = len(content)
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        chars += len(json.dumps(tool_calls, default=str))
+    return math.ceil(chars / _CHARS_PER_TOKEN) + _MESSAGE_OVERHEAD_TOKENS
+
+
+def getTokenCounter(mode: str, model):
+    """Count the tokens of a single message, estimated locally or with the model's tokenizer"""
+    if mode not in TOKEN_COUNTER_MODES:
+        raise ValueError(f"Unknown token counter mode '{mode}', expected one of {TOKEN_COUNTER_MODES}")
+    if mode == "model":
+        return lambda message: model.get_num_tokens_from_messages([message])
+    return estimate_tokens
+
+
+def trim_to_budget(messages: list[AnyMessage], token_counts: dict, max_tokens: int, count_tokens) -> tuple[list[AnyMessage], dict]:
+    """Keep the most recent messages that fit within max_tokens.
+
+    Counts are looked up by message id, so each message is counted once over the
+    life of a thread; the walk stops at the budget, so older history is never
+    touched. Returns the kept messages and the counts of newly counted messages.
+    """
+    new_counts = {}
+    total = 0
+    start = len(messages)
+    for message in reversed(messages):
+        tokens = token_counts.get(message.id) if message.id else None
+        if tokens is None:
+            tokens = count_tokens(message)
+            if message.id:
+                new_counts[message.id] = tokens
+        if total + tokens > max_tokens:
+            break
+        total += tokens
+        start -= 1
+
+    # Never start on tool results whose tool call was trimmed away
+    while start < len(messages) and isinstance(messages[start], ToolMessage):
+        start += 1
+    return messages[start:], new_counts
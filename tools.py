@@ -11,6 +11,18 @@ from langchain_mcp_adapters.client import MultiServerMCPClient
 from a2a_client import A2AClient
 from dto import MessageDetail
 
+def cacheable(tool, ttl_seconds: float = None, scope: str = "global"):
+    """Declare that a tool's results may be cached.
+
+    The tool must return the same result for the same arguments within the TTL
+    (None means forever). Results are shared across users for scope "global"
+    and kept per user for scope "user".
+    """
+    if scope not in ("global", "user"):
+        raise ValueError(f"Unknown tool cache scope '{scope}'")
+    tool.metadata = {**(tool.metadata or {}), "cache": {"ttl_seconds": ttl_seconds, "scope": scope}}
+    return tool
+
 # [START] Mathematical tools
 @tool
 def add_numbers(x: int, y: int) -> int:
@@ -42,7 +54,7 @@ def getWikipediaTool():
     )
 
     # Initialize the Wikipedia query tool
-    return WikipediaQueryRun(api_wrapper=api_wrapper)
+    return cacheable(WikipediaQueryRun(api_wrapper=api_wrapper), ttl_seconds=24 * 3600)
 
 
 def getMCPServersConfig():
@@ -80,38 +92,42 @@ async def analyze_codebase(query: str) -> str:
     Returns:
         Analysis results from the code mentor agent
     """
-    try:
-        # Create a message for the code mentor agent
-        messages = [
-            MessageDetail(
-                role="user",
-                content=query
-            )
-        ]
-        
-        # Make A2A request to code-mentor-rag agent
-        response = await code_mentor_client.invoke(
-            messages=messages,
-            thread_id="codebase_analysis",  # You can make this dynamic if needed
-            user_id="system"  # Or use the actual user_id from context
+    # Failures raise instead of returning an error text, so the tool node reports
+    # them to the model as a failed call and they are never cached.
+
+    # Create a message for the code mentor agent
+    messages = [
+        MessageDetail(
+            role="user",
+            content=query
         )
-        
-        # Check if the response is successful
-        if response.error:
-            return f"Error from code mentor agent: {response.error.get('message', 'Unknown error')}"
-        
-        # Extract the assistant's response
-        if response.result and "messages" in response.result:
-            result_messages = response.result["messages"]
-            # Find the last assistant message
-            for msg in reversed(result_messages):
-                if msg.get("role") == "assistant":
-                    return msg.get("content", "No response content")
-        
-        return "No response from code mentor agent"
-        
-    except Exception as e:
-        return f"Error communicating with code mentor agent: {str(e)}"
+    ]
+
+    # Make A2A request to code-mentor-rag agent
+    response = await code_mentor_client.invoke(
+        messages=messages,
+        thread_id="codebase_analysis",  # You can make this dynamic if needed
+        user_id="system"  # Or use the actual user_id from context
+    )
+
+    # Check if the response is successful
+    if response.error:
+        raise RuntimeError(f"Error from code mentor agent: {response.error.get('message', 'Unknown error')}")
+
+    # Extract the assistant's response
+    if response.result and "messages" in response.result:
+        result_messages = response.result["messages"]
+        # Find the last assistant message
+        for msg in reversed(result_messages):
+            if msg.get("role") == "assistant":
+                return msg.get("content", "No response content")
+
+    return "No response from code mentor agent"
+
+# Pure functions, and codebase answers that only change as the codebase does
+cacheable(add_numbers)
+cacheable(multiply)
+cacheable(analyze_codebase, ttl_seconds=3600)
 
 async def getTools():
     # mcpServersConfig = getMCPServersConfig()
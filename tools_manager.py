@@ -1,14 +1,165 @@
 # Semantic search tools
 import asyncio
+import hashlib
+import json
+import os
+import re
+import time
 import tomllib
+from collections import OrderedDict
+
+import numpy as np
 from langchain_core.documents import Document
 from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_ollama import OllamaEmbeddings
 
+from embedding_cache import get_embeddings
 from tools import getTools
 import uuid
 
-from utils import getValueFromConfig
+from utils import getValueFromConfig, run_blocking
+
+# Namespace of the tool IDs, which must stay fixed for persisted indexes to remain valid
+_TOOL_ID_NAMESPACE = uuid.UUID("6f1c1b9e-2a4d-4f57-9a3e-8d0c5b7e41a2")
+
+
+def _tool_id(tool) -> str:
+    """Deterministic tool ID derived from the tool's name and description.
+
+    A changed description yields a new ID, so its embedding is recomputed.
+    """
+    description_hash = hashlib.sha256(tool.description.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(_TOOL_ID_NAMESPACE, f"{tool.name}:{description_hash}"))
+
+
+def _normalize_query(query: str) -> str:
+    """Cache key of a query: case, whitespace and numbers don't change the tools it needs"""
+    query = re.sub(r"\d+(\.\d+)?", "#", query.lower())
+    return " ".join(query.split())
+
+
+class _ToolSelectionCache:
+    """LRU cache of the tools selected for recent queries.
+
+    Entries are keyed by the normalized query. A miss can still be served by a
+    recent query whose embedding is at least `similarity_threshold` similar.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        # 0 disables the similarity lookup
+        self._similarity_threshold = similarity_threshold
+        # normalized query -> (tool IDs, unit query embedding, expiry time)
+        self._entries = OrderedDict()
+        self._version = None
+
+    @property
+    def similarity_enabled(self) -> bool:
+        return self._similarity_threshold > 0
+
+    def _check_version(self, version: int):
+        # Selections made against another tool registry are stale
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _evict_expired(self, now: float):
+        for key in [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+
+    def get(self, key: str, version: int):
+        """Tool IDs cached for the normalized query, or None"""
+        self._check_version(version)
+        entry = self._entries.get(key)
+        if entry is None or entry[2] <= time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get_similar(self, embedding: np.ndarray, version: int):
+        """Tool IDs of the most similar recent query above the threshold, or None"""
+        self._check_version(version)
+        self._evict_expired(time.monotonic())
+        if not self._entries:
+            return None
+        keys = list(self._entries)
+        similarities = np.stack([self._entries[key][1] for key in keys]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self._similarity_threshold:
+            return None
+        self._entries.move_to_end(keys[best])
+        return self._entries[keys[best]][0]
+
+    def put(self, key: str, version: int, tool_ids: list[str], embedding: np.ndarray):
+        self._check_version(version)
+        self._entries[key] = (tool_ids, embedding, time.monotonic() + self._ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+class _ToolResultCache:
+    """LRU cache of tool results, for tools that declare a cache policy in their metadata"""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        # (tool name, user scope, arguments) -> (result, expiry time or None)
+        self._entries = OrderedDict()
+        # tool name -> {"hits": n, "misses": n}
+        self._stats = {}
+
+    @staticmethod
+    def policy(tool):
+        """The tool's declared cache policy, or None if its results must not be cached"""
+        return (tool.metadata or {}).get("cache")
+
+    @staticmethod
+    def _key(tool, policy: dict, args: dict, user_id: str):
+        scope = user_id if policy["scope"] == "user" else ""
+        return tool.name, scope, json.dumps(args, sort_keys=True, default=str)
+
+    def _count(self, tool_name: str, outcome: str):
+        stats = self._stats.setdefault(tool_name, {"hits": 0, "misses": 0})
+        stats[outcome] += 1
+
+    def get(self, tool, args: dict, user_id: str):
+        """Return (True, result) on a hit and (False, None) otherwise"""
+        policy = self.policy(tool)
+        if policy is None:
+            return False, None
+        key = self._key(tool, policy, args, user_id)
+        entry = self._entries.get(key)
+        if entry is None or (entry[1] is not None and entry[1] <= time.monotonic()):
+            self._entries.pop(key, None)
+            self._count(tool.name, "misses")
+            return False, None
+        self._entries.move_to_end(key)
+        self._count(tool.name, "hits")
+        return True, entry[0]
+
+    def put(self, tool, args: dict, user_id: str, result):
+        policy = self.policy(tool)
+        if policy is None:
+            return
+        ttl_seconds = policy["ttl_seconds"]
+        expires_at = None if ttl_seconds is None else time.monotonic() + ttl_seconds
+        key = self._key(tool, policy, args, user_id)
+        self._entries[key] = (result, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "tools": {name: dict(stats) for name, stats in self._stats.items()},
+        }
+
+
+def _unit_vector(vector: list[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
 
 
 class _ToolsManager:
@@ -18,6 +169,12 @@ class _ToolsManager:
         self._vector_store = None
         self._tools = None
         self._tool_registry = None
+        self._semantic_search_enabled = False
+        self._index_path = "./tool_index.json"
+        self._selection_cache = None
+        self._result_cache = None
+        # Bumped whenever the tool registry is replaced, invalidating cached selections
+        self._registry_version = 0
         self._initialized = False
         self._lock = asyncio.Lock()
 
@@ -28,26 +185,59 @@ class _ToolsManager:
                 print("Initializing Tools...")
 
                 semantic_search_embeddings_model = getValueFromConfig("tools", "semantic_search_embeddings_model")
+                self._semantic_search_enabled = getValueFromConfig("tools", "semantic_search_enabled") == "true"
+
+                self._index_path = getValueFromConfig("tools", "index_path", self._index_path)
 
-                embeddings = OllamaEmbeddings(model=semantic_search_embeddings_model)
-                self._vector_store = InMemoryVectorStore(embeddings)
-                
+                embeddings = get_embeddings(semantic_search_embeddings_model)
                 self._tools = await getTools()
-                self._tool_registry = {str(uuid.uuid4()): tool for tool in self._tools}
-
-                tool_documents = [
-                    Document(
-                        page_content=tool.description,
-                        id=id,
-                        metadata={"tool_name": tool.name},
-                    )
-                    for id, tool in self._tool_registry.items()
-                ]
-                self._vector_store.add_documents(tool_documents)
+                self._tool_registry = {_tool_id(tool): tool for tool in self._tools}
+                self._vector_store = await self._load_index(embeddings, semantic_search_embeddings_model)
+                self._registry_version += 1
+
+                self._selection_cache = _ToolSelectionCache(
+                    max_entries=getValueFromConfig("tools", "selection_cache_max_entries", 256),
+                    ttl_seconds=getValueFromConfig("tools", "selection_cache_ttl_seconds", 600),
+                    similarity_threshold=getValueFromConfig("tools", "selection_cache_similarity_threshold", 0.95),
+                )
+                self._result_cache = _ToolResultCache(getValueFromConfig("tools", "result_cache_max_entries", 1024))
 
                 self._initialized = True
                 print("Tools initialized successfully!")
 
+    async def _load_index(self, embeddings, embeddings_model: str) -> InMemoryVectorStore:
+        """Load the persisted tool index, embedding only tools that are new or changed"""
+        vector_store = InMemoryVectorStore(embeddings)
+        if os.path.exists(self._index_path):
+            try:
+                loaded = await run_blocking(InMemoryVectorStore.load, self._index_path, embeddings)
+                # Vectors of another embedding model aren't comparable to query embeddings
+                if all(entry["metadata"].get("embeddings_model") == embeddings_model for entry in loaded.store.values()):
+                    vector_store = loaded
+                else:
+                    print(f"Tool index {self._index_path} was built with another embedding model, rebuilding it")
+            except Exception as e:
+                print(f"Error loading tool index {self._index_path}, rebuilding it: {e}")
+
+        stale_ids = [id for id in vector_store.store if id not in self._tool_registry]
+        tool_documents = [
+            Document(
+                page_content=tool.description,
+                id=id,
+                metadata={"tool_name": tool.name, "embeddings_model": embeddings_model},
+            )
+            for id, tool in self._tool_registry.items()
+            if id not in vector_store.store
+        ]
+        if stale_ids:
+            await vector_store.adelete(stale_ids)
+        if tool_documents:
+            await vector_store.aadd_documents(tool_documents)
+        if stale_ids or tool_documents:
+            print(f"Tool index updated: {len(tool_documents)} embedded, {len(stale_ids)} removed")
+            await run_blocking(vector_store.dump, self._index_path)
+        return vector_store
+
     async def cleanup(self):
         """Cleanup the tools components"""
         async with self._lock:
@@ -57,6 +247,9 @@ class _ToolsManager:
                 self._vector_store = None
                 self._tools = None
                 self._tool_registry = None
+                self._registry_version += 1
+                self._selection_cache = None
+                self._result_cache = None
                 self._initialized = False
                 print("Tools cleaned up successfully!")
 
@@ -75,6 +268,42 @@ class _ToolsManager:
         """Get the tool registry instance"""
         return self._tool_registry
 
+    @property
+    def registry_version(self):
+        """Version of the tool registry, changed whenever its tools change"""
+        return self._registry_version
+
+    @property
+    def result_cache(self):
+        """Get the tool result cache instance"""
+        return self._result_cache
+
+    @property
+    def semantic_search_enabled(self):
+        """Whether tools are selected by semantic search over their descriptions"""
+        return self._semantic_search_enabled
+
+    async def select_tools(self, query: str) -> list[str]:
+        """IDs of the tools relevant to the query, served from the selection cache when possible"""
+        cache = self._selection_cache
+        version = self._registry_version
+        key = _normalize_query(query)
+        tool_ids = cache.get(key, version)
+        if tool_ids is not None:
+            return tool_ids
+
+        vector = await self._vector_store.embeddings.aembed_query(query)
+        embedding = _unit_vector(vector)
+        if cache.similarity_enabled:
+            tool_ids = cache.get_similar(embedding, version)
+            if tool_ids is not None:
+                return tool_ids
+
+        documents = await self._vector_store.asimilarity_search_by_vector(vector)
+        tool_ids = [document.id for document in documents]
+        cache.put(key, version, tool_ids, embedding)
+        return tool_ids
+
 _manager = _ToolsManager()
 
 async def initialize_tools():
@@ -89,17 +318,40 @@ def get_vector_store():
     """Get the vector store instance"""
     return _manager.vector_store
 
+def get_tools():
+    """Get the tools shared by tool search and the agent"""
+    return _manager.tools
+
 def get_tool_registry():
     """Get the tool registry instance"""
     return _manager.tool_registry
 
-def get_tools_by_query(query: str):
+def get_tool_registry_version() -> int:
+    """Get the version of the tool registry, changed whenever its tools change"""
+    return _manager.registry_version
+
+def get_cached_tool_result(tool, args: dict, user_id: str):
+    """Look up a cached result of the tool call, returning (hit, result)"""
+    if _manager.result_cache is None:
+        return False, None
+    return _manager.result_cache.get(tool, args, user_id)
+
+def cache_tool_result(tool, args: dict, user_id: str, result):
+    """Cache the result of a successful tool call if the tool declares a cache policy"""
+    if _manager.result_cache is not None:
+        _manager.result_cache.put(tool, args, user_id, result)
+
+def get_tool_result_cache_stats() -> dict:
+    """Get the number of cached tool results and the hits and misses per tool"""
+    if _manager.result_cache is None:
+        return {"entries": 0, "tools": {}}
+    return _manager.result_cache.stats()
+
+async def get_tools_by_query(query: str):
     """Get the tools by query"""
-    semantic_search_enabled = getValueFromConfig("tools", "semantic_search_enabled")
-    if semantic_search_enabled == "true":
+    if _manager.semantic_search_enabled:
         # vector store would have been created till now
         # in the app boostrap
-        documents =_manager.vector_store.similarity_search(query)
-        return [document.id for document in documents]
+        return await _manager.select_tools(query)
     else:
         return [id for id in get_tool_registry().keys()]
\ No newline at end of file
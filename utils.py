@@ -1,3 +1,6 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
 from typing import Any, List
 from langchain.messages import AnyMessage, HumanMessage, ToolMessage
 import tomllib
@@ -32,13 +35,33 @@ def convert_arg_types(value):
     # Return as-is if no conversion needed
     return value
 
-def getValueFromConfig(root_key, key):
+def getValueFromConfig(root_key, key, default=None):
     config_path = "config.toml"
     config = {}
     with open(config_path, "rb") as f:
         config = tomllib.load(f)
     tools_config = config.get(root_key, {})
-    return tools_config[key] if key in tools_config else None
+    return tools_config[key] if key in tools_config else default
+
+def getSectionFromConfig(root_key, default=None):
+    config_path = "config.toml"
+    with open(config_path, "rb") as f:
+        config = tomllib.load(f)
+    return config.get(root_key, default)
+
+# Bounded pool for blocking work (FAISS search, index I/O) that must stay off the event loop
+_blocking_executor = None
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the shared bounded thread pool"""
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(
+            max_workers=getValueFromConfig("runtime", "blocking_pool_size", 8),
+            thread_name_prefix="blocking",
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
 
 
 class MessageConverter:
@@ -54,6 +77,7 @@ class MessageConverter:
             
             if msg_type == "HumanMessage":
                 a2a_messages.append(MessageDetail(
+                    id=msg.id,
                     role="user",
                     content=str(msg.content)
                 ))
@@ -64,17 +88,20 @@ class MessageConverter:
                     tool_calls = msg.tool_calls
                 
                 a2a_messages.append(MessageDetail(
+                    id=msg.id,
                     role="assistant",
                     content=str(msg.content),
                     tool_calls=tool_calls
                 ))
             elif msg_type == "SystemMessage":
                 a2a_messages.append(MessageDetail(
+                    id=msg.id,
                     role="system",
                     content=str(msg.content)
                 ))
             elif msg_type == "ToolMessage":
                 a2a_messages.append(MessageDetail(
+                    id=msg.id,
                     role="tool",
                     content=str(msg.content),
                     tool_call_id=getattr(msg, 'tool_call_id', None)